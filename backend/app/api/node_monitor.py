@@ -1,5 +1,7 @@
-from fastapi import APIRouter, HTTPException, WebSocket, BackgroundTasks
-from ..celery_config import redis_client
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from ..celery_config import TASK_LATENCY_PREFIX
+from ..services.async_redis import get_async_redis
+from ..services.load_router import NODE_STATS_KEY, parse_node_stats
 import psutil
 import os
 import logging
@@ -12,9 +14,6 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-NODE_STATS_PREFIX = "node_stats:"
-NODE_EXPIRY_SECONDS = 10 # 節點狀態在 Redis 中的過期時間 (例如 10 秒)
-
 def get_current_node_name():
     # 保持原有的節點命名邏輯，確保唯一性
     # 如果 PORT 環境變數不可靠或不明確，需要找到更可靠的方式來命名節點
@@ -36,88 +35,125 @@ def get_node_stats():
         logger.exception("獲取本機節點狀態失敗: %s", str(e))
         return None
 
+async def read_all_node_stats():
+    """以一次 HGETALL 讀取所有節點狀態，並順便清除離線節點"""
+    redis = get_async_redis()
+    nodes, stale = parse_node_stats(await redis.hgetall(NODE_STATS_KEY))
+    if stale:
+        await redis.hdel(NODE_STATS_KEY, *stale)
+    return nodes
+
 async def update_node_stats_in_redis():
     """定期獲取本機節點狀態並更新到 Redis"""
     node_name = get_current_node_name()
-    redis_key = f"{NODE_STATS_PREFIX}{node_name}"
+    redis = get_async_redis()
     while True:
         try:
             stats = get_node_stats()
             if stats:
-                # 將節點名稱加入到 stats 中，以便前端知道是哪個節點
-                stats_with_name = {"node": node_name, **stats}
-                redis_client.setex(redis_key, NODE_EXPIRY_SECONDS, json.dumps(stats_with_name))
+                # 將節點名稱與更新時間加入到 stats 中，以便前端知道是哪個節點、讀取端判斷是否過期
+                stats_with_name = {"node": node_name, "updated_at": time.time(), **stats}
+                await redis.hset(NODE_STATS_KEY, node_name, json.dumps(stats_with_name))
                 logger.debug(f"節點 {node_name} 狀態已更新到 Redis: {stats_with_name}")
             else:
                 logger.warning(f"節點 {node_name} 無法獲取狀態，從 Redis 中移除 (或標記為不活躍)")
-                # 可以選擇刪除鍵，或保留但標記為不活躍
-                # redis_client.delete(redis_key)
         except Exception as e:
             logger.exception(f"更新節點 {node_name} 狀態到 Redis 失敗: {str(e)}")
         await asyncio.sleep(1) # 每秒更新一次
 
+
+class NodeStatsBroadcaster:
+    """每秒只讀取一次 Redis，將同一份快照推送給所有 WebSocket 客戶端"""
+
+    def __init__(self):
+        self.clients = set()
+        self.snapshot = None
+
+    async def run(self):
+        while True:
+            try:
+                self.snapshot = json.dumps({"nodes": await read_all_node_stats()})
+            except Exception as e:
+                logger.exception("WebSocket: 從 Redis 獲取節點狀態時發生錯誤: %s", str(e))
+                self.snapshot = json.dumps({"error": "無法從 Redis 獲取節點狀態"})
+            if self.clients:
+                clients = list(self.clients)
+                results = await asyncio.gather(
+                    *(websocket.send_text(self.snapshot) for websocket in clients), return_exceptions=True
+                )
+                for websocket, result in zip(clients, results):
+                    if isinstance(result, Exception):
+                        self.clients.discard(websocket)
+                logger.debug("WebSocket 推送節點狀態給 %d 個客戶端", len(clients))
+            await asyncio.sleep(1) # 每秒推送一次
+
+
+broadcaster = NodeStatsBroadcaster()
+
 @router.on_event("startup")
 async def startup_event():
     # 啟動背景任務來持續更新此節點的狀態到 Redis
     # 這確保了每個 node_monitor.py 實例都會上報自己的狀態
     asyncio.create_task(update_node_stats_in_redis())
-    logger.info("節點狀態更新背景任務已啟動。")
+    asyncio.create_task(broadcaster.run())
+    logger.info("節點狀態更新與廣播背景任務已啟動。")
 
 
 @router.get("/nodes")
 async def list_all_node_stats():
     """從 Redis 獲取所有活動節點的狀態"""
-    nodes_data = []
     try:
-        # 掃描所有符合模式的鍵
-        for key in redis_client.scan_iter(f"{NODE_STATS_PREFIX}*"):
-            node_data_json = redis_client.get(key)
-            if node_data_json:
-                try:
-                    nodes_data.append(json.loads(node_data_json))
-                except json.JSONDecodeError:
-                    logger.error(f"無法解析 Redis 中的節點數據: {key.decode('utf-8')}")
-        
+        nodes_data = await read_all_node_stats()
         if not nodes_data:
             logger.info("Redis 中沒有找到節點狀態數據。")
-            # 可以回傳空列表或特定訊息
-            # raise HTTPException(status_code=404, detail="沒有可用的節點狀態")
-
         return {"nodes": nodes_data}
     except Exception as e:
         logger.exception("從 Redis 列出節點狀態失敗: %s", str(e))
         raise HTTPException(status_code=500, detail=f"列出節點狀態失敗: {str(e)}")
 
+@router.get("/nodes/latency")
+async def list_task_latency():
+    """回傳各節點任務延遲，區分冷啟動 (模型尚未載入) 與熱啟動"""
+    latency = {}
+    try:
+        redis = get_async_redis()
+        keys = [key async for key in redis.scan_iter(f"{TASK_LATENCY_PREFIX}*")]
+        pipe = redis.pipeline()
+        for key in keys:
+            pipe.hgetall(key)
+        for key, raw in zip(keys, await pipe.execute()):
+            node_name = key[len(TASK_LATENCY_PREFIX):]
+            node_latency = {}
+            for field, value in raw.items():
+                task_name, kind, metric = field.split(":")
+                if metric != "count":
+                    continue
+                count = int(value)
+                seconds = float(raw.get(f"{task_name}:{kind}:seconds", 0))
+                node_latency.setdefault(task_name, {})[kind] = {
+                    "count": count,
+                    "avg_seconds": round(seconds / count, 4) if count else None,
+                }
+            latency[node_name] = node_latency
+        return {"latency": latency}
+    except Exception as e:
+        logger.exception("從 Redis 讀取任務延遲失敗: %s", str(e))
+        raise HTTPException(status_code=500, detail=f"讀取任務延遲失敗: {str(e)}")
+
 @router.websocket("/ws/nodes")
 async def websocket_all_nodes(websocket: WebSocket):
     await websocket.accept()
     try:
+        if broadcaster.snapshot is not None:
+            await websocket.send_text(broadcaster.snapshot)
+        broadcaster.clients.add(websocket)
         while True:
-            nodes_data = []
-            try:
-                for key in redis_client.scan_iter(f"{NODE_STATS_PREFIX}*"):
-                    node_data_json = redis_client.get(key)
-                    if node_data_json:
-                        try:
-                            nodes_data.append(json.loads(node_data_json))
-                        except json.JSONDecodeError:
-                            logger.error(f"WebSocket: 無法解析 Redis 中的節點數據: {key.decode('utf-8')}")
-                
-                if nodes_data:
-                    await websocket.send_text(json.dumps({"nodes": nodes_data}))
-                    logger.debug(f"WebSocket 推送 {len(nodes_data)} 個節點狀態")
-                else:
-                    # 如果沒有數據，可以選擇不發送，或發送空列表/特定訊息
-                    await websocket.send_text(json.dumps({"nodes": []})) # 或者 {"message": "等待節點數據..."}
-                    logger.debug("WebSocket: Redis 中沒有找到節點狀態數據，推送空列表。")
-
-            except Exception as e: # 捕捉 Redis 相關錯誤
-                logger.exception("WebSocket: 從 Redis 獲取節點狀態時發生錯誤: %s", str(e))
-                await websocket.send_text(json.dumps({"error": "無法從 Redis 獲取節點狀態"}))
-            
-            await asyncio.sleep(1) # 每秒推送一次
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
     except Exception as e: # 捕捉 WebSocket 連接等錯誤
         logger.exception("WebSocket 錯誤: %s", str(e))
+        await websocket.close()
     finally:
+        broadcaster.clients.discard(websocket)
         logger.info(f"WebSocket 連接已關閉: {websocket.client}")
-        await websocket.close()
\ No newline at end of file
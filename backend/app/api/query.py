@@ -1,6 +1,18 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
-from ..celery_config import query_task
+from typing import Optional, Dict, List, Union
+from ..celery_config import query_task, batch_query_task
+from ..services.query_cache import summarize_cache_stats, QUERY_CACHE_STATS_KEY
+from ..services.async_redis import get_async_redis
+from ..services import service_registry, staging, batch_queries
+from ..services.result_store import fetch_contents, RESULT_FETCH_MAX_IDS
+from ..services.tenants import collection_for, build_filter, allow_request, TENANT_QUERY_RATE_LIMIT
+from .upload import spool_upload
+from starlette.concurrency import run_in_threadpool
+import json
+import asyncio
+import os
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
@@ -8,19 +20,193 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# 是否允許在 API 行程內直接執行查詢；停用時 /query/direct 一律改走 Celery
+DIRECT_QUERY_ENABLED = os.getenv("DIRECT_QUERY_ENABLED", "1") == "1"
+
+@router.on_event("startup")
+async def warmup_direct_query():
+    if not DIRECT_QUERY_ENABLED:
+        return
+
+    async def _warmup():
+        try:
+            service = await run_in_threadpool(service_registry.get_direct_query_service)
+            await run_in_threadpool(service.warmup)
+            logger.info("直接查詢服務預熱完成")
+        except Exception as e:
+            logger.exception("直接查詢服務預熱失敗: %s", str(e))
+
+    # 在背景載入模型，不延遲 API 啟動
+    asyncio.create_task(_warmup())
+
 class QueryRequest(BaseModel):
     query: str
+    # 覆寫集合設定檔的查詢參數，供調校召回率與延遲使用
+    hnsw_ef: Optional[int] = None
+    exact: Optional[bool] = None
+    # 租戶決定查詢的集合；filters 只允許已建立 payload 索引的欄位，例如 {"source": ["a.csv", "b.csv"]}
+    tenant: Optional[str] = None
+    filters: Optional[Dict[str, Union[str, List[str]]]] = None
+
+async def resolve_collection(request):
+    """驗證租戶與篩選條件並檢查租戶的查詢頻率，回傳集合名稱"""
+    try:
+        collection_name = collection_for(request.tenant)
+        build_filter(request.filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        allowed = await allow_request(get_async_redis(), request.tenant, "query", TENANT_QUERY_RATE_LIMIT)
+    except Exception as e:
+        # 計數失敗時不阻擋查詢
+        logger.warning("檢查租戶查詢頻率失敗: %s", str(e))
+        allowed = True
+    if not allowed:
+        raise HTTPException(status_code=429, detail="此租戶的查詢次數已超過每分鐘上限")
+    return collection_name
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    tenant: Optional[str] = None
+    filters: Optional[Dict[str, Union[str, List[str]]]] = None
+    limit: int = 5
+
+class ContentRequest(BaseModel):
+    # 查詢任務結果中的 point ID
+    ids: List[Union[int, str]]
+    tenant: Optional[str] = None
+
+def check_batch_limit(limit):
+    if not 1 <= limit <= batch_queries.BATCH_QUERY_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit 必須介於 1 與 {batch_queries.BATCH_QUERY_MAX_LIMIT} 之間")
 
 @router.get("/query")
 async def get_query():
     return {"message": "Please use POST method to submit a query"}
 
+@router.get("/query/cache/stats")
+async def get_query_cache_stats():
+    """回傳查詢快取 L1 (查詢向量) 與 L2 (查詢結果) 的命中率"""
+    try:
+        raw = await get_async_redis().hgetall(QUERY_CACHE_STATS_KEY)
+        return {"cache": summarize_cache_stats(raw)}
+    except Exception as e:
+        logger.exception("讀取快取統計失敗: %s", str(e))
+        raise HTTPException(status_code=500, detail=f"讀取快取統計失敗: {str(e)}")
+
+@router.post("/query/contents")
+async def get_query_contents(request: ContentRequest):
+    """依 point ID 取回完整內容；查詢任務的結果只保存截斷後的內容"""
+    if len(request.ids) > RESULT_FETCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"一次最多取回 {RESULT_FETCH_MAX_IDS} 筆內容")
+    try:
+        collection_name = collection_for(request.tenant)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        contents = await run_in_threadpool(
+            fetch_contents, service_registry.get_qdrant_client(), collection_name, request.ids
+        )
+        return {"contents": contents}
+    except Exception as e:
+        logger.exception("取回內容失敗: %s", str(e))
+        raise HTTPException(status_code=500, detail=f"取回內容失敗: {str(e)}")
+
 @router.post("/query")
 async def query_knowledge_base(request: QueryRequest):
     logger.debug("收到查詢請求: %s", request.query)
+    collection_name = await resolve_collection(request)
     try:
-        task = query_task.delay(request.query)
+        task = query_task.delay(request.query, request.hnsw_ef, request.exact, collection_name, request.filters)
         return {"task_id": task.id, "message": "任務已提交到隊列"}
     except Exception as e:
         logger.exception("提交任務失敗: %s", str(e))
-        raise HTTPException(status_code=500, detail=f"提交任務失敗: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"提交任務失敗: {str(e)}")
+
+@router.post("/query/direct")
+async def query_knowledge_base_direct(request: QueryRequest):
+    """在 API 行程內直接查詢並回傳結果；本機已滿載時退回 Celery 並回傳 task_id"""
+    logger.debug("收到直接查詢請求: %s", request.query)
+    collection_name = await resolve_collection(request)
+    # 模型可能仍在背景預熱中，於執行緒池中取得服務以免阻塞事件迴圈
+    service = await run_in_threadpool(service_registry.get_direct_query_service) if DIRECT_QUERY_ENABLED else None
+    if service is None or service.saturated():
+        try:
+            task = query_task.delay(request.query, request.hnsw_ef, request.exact, collection_name, request.filters)
+            return {"mode": "queued", "task_id": task.id, "message": "任務已提交到隊列"}
+        except Exception as e:
+            logger.exception("提交任務失敗: %s", str(e))
+            raise HTTPException(status_code=500, detail=f"提交任務失敗: {str(e)}")
+    try:
+        results = await service.query(
+            request.query, limit=5, hnsw_ef=request.hnsw_ef, exact=request.exact,
+            collection_name=collection_name, filters=request.filters
+        )
+        return {"mode": "direct", "results": results}
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.exception("直接查詢失敗: %s", str(e))
+        raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
+
+@router.post("/query/batch")
+async def query_knowledge_base_batch(request: BatchQueryRequest):
+    """提交一批查詢，由少數幾個任務大批編碼並以 search_batch 搜尋；進度顯示於任務管理員"""
+    logger.debug("收到批次查詢請求: %d 個查詢", len(request.queries))
+    check_batch_limit(request.limit)
+    if not any(query.strip() for query in request.queries):
+        raise HTTPException(status_code=400, detail="沒有可執行的查詢")
+    collection_name = await resolve_collection(request)
+    staged_name = staging.new_staged_name(".ndjson")
+    try:
+        await run_in_threadpool(batch_queries.write_query_list, staging.resolve(staged_name), request.queries)
+        task = batch_query_task.delay(staged_name, collection_name, request.filters, request.limit)
+        return {"task_id": task.id, "queries": len(request.queries), "message": "任務已提交到隊列"}
+    except Exception as e:
+        staging.remove(staged_name)
+        logger.exception("提交批次查詢失敗: %s", str(e))
+        raise HTTPException(status_code=500, detail=f"提交任務失敗: {str(e)}")
+
+@router.post("/query/batch/file")
+async def query_knowledge_base_batch_file(
+    file: UploadFile = File(...),
+    tenant: Optional[str] = Form(None),
+    filters: Optional[str] = Form(None),
+    limit: int = Form(5),
+):
+    """上傳查詢檔 (.txt 每行一個查詢，或含 query 欄位的 .csv / .ndjson) 並提交批次查詢"""
+    logger.debug("收到批次查詢檔: %s", file.filename)
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    if suffix not in batch_queries.QUERY_FILE_SUFFIXES:
+        raise HTTPException(status_code=400, detail=f"僅支援 {', '.join(batch_queries.QUERY_FILE_SUFFIXES)} 檔案")
+    check_batch_limit(limit)
+    try:
+        request = BatchQueryRequest(queries=[], tenant=tenant, filters=json.loads(filters) if filters else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"無效的篩選條件: {str(e)}")
+    collection_name = await resolve_collection(request)
+    staged_name = staging.new_staged_name(suffix)
+    try:
+        size = await spool_upload(file, staged_name)
+        logger.debug("查詢檔大小: %d bytes，暫存為 %s", size, staged_name)
+        task = batch_query_task.delay(staged_name, collection_name, request.filters, limit)
+        return {"task_id": task.id, "message": "任務已提交到隊列"}
+    except Exception as e:
+        staging.remove(staged_name)
+        logger.exception("提交批次查詢失敗: %s", str(e))
+        raise HTTPException(status_code=500, detail=f"提交任務失敗: {str(e)}")
+
+@router.get("/query/batch/{task_id}/results")
+async def get_batch_query_results(task_id: str):
+    """以 NDJSON 串流回傳批次查詢結果，每行為 {"id", "query", "results"}"""
+    try:
+        path = batch_queries.result_path(task_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        expired = await run_in_threadpool(batch_queries.results_expired, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="結果尚未產生或任務不存在")
+    if expired:
+        raise HTTPException(status_code=404, detail="結果已過期")
+    return FileResponse(path, media_type="application/x-ndjson", filename=f"{task_id}.ndjson")
@@ -1,9 +1,19 @@
-from fastapi import APIRouter, HTTPException, WebSocket
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Query
 from celery.result import AsyncResult
-from ..celery_config import app as celery_app, redis_client
+from ..celery_config import app as celery_app
+from ..services.async_redis import get_async_redis
+from ..services.batch_queries import remove_expired_results
+from ..services.task_events import (
+    TASK_INDEX_KEY, TASK_EVENTS_CHANNEL, TASK_META_PREFIX, build_task_data, task_data_from_meta,
+    TASK_INDEX_MAX_AGE_SECONDS, TASK_INDEX_COMPACT_INTERVAL, TASK_INDEX_COMPACT_LOCK,
+    TASK_INDEX_COMPACT_BATCH, TASK_INDEX_PENDING_GRACE_SECONDS
+)
+from starlette.concurrency import run_in_threadpool
 import logging
 import json
 import asyncio
+import time
+import os
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -39,7 +49,11 @@ async def cancel_task(task_id: str):
         task = AsyncResult(task_id, app=celery_app)
         if task.state == "PENDING":
             task.revoke()
-            redis_client.srem('task_ids', task_id)
+            redis = get_async_redis()
+            pipe = redis.pipeline()
+            pipe.zrem(TASK_INDEX_KEY, task_id)
+            pipe.publish(TASK_EVENTS_CHANNEL, json.dumps(build_task_data(task_id, "REVOKED")))
+            await pipe.execute()
             logger.debug("任務 %s 已取消", task_id)
             return {"message": f"任務 {task_id} 已取消"}
         else:
@@ -49,53 +63,143 @@ async def cancel_task(task_id: str):
         logger.exception("取消任務失敗: %s", str(e))
         raise HTTPException(status_code=500, detail=f"取消任務失敗: {str(e)}")
 
+async def fetch_task_page(offset=0, limit=50):
+    """依提交時間由新到舊取出一頁任務；狀態以單次 MGET 從結果後端讀取"""
+    redis = get_async_redis()
+    pipe = redis.pipeline()
+    pipe.zrevrange(TASK_INDEX_KEY, offset, offset + limit - 1)
+    pipe.zcard(TASK_INDEX_KEY)
+    task_ids, total = await pipe.execute()
+    tasks = []
+    if task_ids:
+        # 結果可能以 msgpack 儲存，以原始位元組讀取後交由結果後端解碼
+        metas = await get_async_redis(decode_responses=False).mget(
+            [f"{TASK_META_PREFIX}{task_id}" for task_id in task_ids]
+        )
+        tasks = [
+            task_data_from_meta(task_id, meta, celery_app.backend.decode)
+            for task_id, meta in zip(task_ids, metas)
+        ]
+    return tasks, total
+
+async def compact_task_index(redis):
+    """移除索引中結果紀錄已過期 (或超過保留時間) 的任務 ID，回傳移除數量"""
+    now = time.time()
+    removed = await redis.zremrangebyscore(TASK_INDEX_KEY, "-inf", now - TASK_INDEX_MAX_AGE_SECONDS)
+    cutoff = now - TASK_INDEX_PENDING_GRACE_SECONDS
+    offset = 0
+    while True:
+        task_ids = await redis.zrangebyscore(
+            TASK_INDEX_KEY, "-inf", cutoff, start=offset, num=TASK_INDEX_COMPACT_BATCH
+        )
+        if not task_ids:
+            break
+        pipe = redis.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.exists(f"{TASK_META_PREFIX}{task_id}")
+        exists = await pipe.execute()
+        expired = [task_id for task_id, found in zip(task_ids, exists) if not found]
+        if expired:
+            await redis.zrem(TASK_INDEX_KEY, *expired)
+            removed += len(expired)
+        offset += len(task_ids) - len(expired)
+    return removed
+
+async def run_task_index_compaction():
+    node = os.getenv("PORT", "unknown")
+    while True:
+        try:
+            redis = get_async_redis()
+            # 鎖在一個週期後自動過期，不需釋放；取得鎖失敗表示其他節點已在本週期執行
+            if await redis.set(TASK_INDEX_COMPACT_LOCK, node, nx=True, ex=TASK_INDEX_COMPACT_INTERVAL):
+                removed = await compact_task_index(redis)
+                if removed:
+                    logger.info("已從任務索引移除 %d 個過期任務", removed)
+                # 批次查詢結果檔在共用 volume 上，與任務結果同時過期
+                removed_files = await run_in_threadpool(remove_expired_results)
+                if removed_files:
+                    logger.info("已刪除 %d 個過期的批次查詢結果檔", removed_files)
+        except Exception as e:
+            logger.exception("清理任務索引失敗: %s", str(e))
+        await asyncio.sleep(TASK_INDEX_COMPACT_INTERVAL)
+
+@router.on_event("startup")
+async def start_task_index_compaction():
+    if TASK_INDEX_COMPACT_INTERVAL > 0:
+        asyncio.create_task(run_task_index_compaction())
+
 @router.get("/tasks")
-async def list_tasks():
+async def list_tasks(offset: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=500)):
     try:
-        task_ids = redis_client.smembers('task_ids')
-        tasks = []
-        for task_id in task_ids:
-            task = AsyncResult(task_id, app=celery_app)
-            task_data = {
-                "task_id": task_id,
-                "status": task.state,
-                "node": task.info.get("node", "unknown") if task.info else "unknown"
-            }
-            if task.ready():
-                task_data["result"] = task.result if task.state == "SUCCESS" else None
-                task_data["error"] = task.info.get("error", None) if task.state == "FAILED" else None
-            tasks.append(task_data)
-        logger.debug("返回任務列表，數量: %d", len(tasks))
-        return {"tasks": tasks}
+        tasks, total = await fetch_task_page(offset, limit)
+        logger.debug("返回任務列表，數量: %d / %d", len(tasks), total)
+        return {"tasks": tasks, "total": total, "offset": offset, "limit": limit}
     except Exception as e:
         logger.exception("列出任務失敗: %s", str(e))
         raise HTTPException(status_code=500, detail=f"列出任務失敗: {str(e)}")
 
+
+class TaskEventBroadcaster:
+    """每個節點只維持一個 pub/sub 訂閱，將任務狀態變化推送給所有已連線的 WebSocket"""
+
+    def __init__(self):
+        self.clients = set()
+        self._task = None
+
+    def ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            pubsub = get_async_redis().pubsub()
+            try:
+                await pubsub.subscribe(TASK_EVENTS_CHANNEL)
+                logger.info("任務事件廣播器已訂閱 %s", TASK_EVENTS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    payload = json.dumps({"type": "delta", "task": json.loads(message["data"])})
+                    await self._broadcast(payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("任務事件訂閱中斷，稍後重試: %s", str(e))
+            finally:
+                # 重新訂閱前釋放舊的連線，避免中斷的訂閱佔用連線池
+                try:
+                    await pubsub.aclose()
+                except Exception as e:
+                    logger.warning("關閉任務事件訂閱失敗: %s", str(e))
+            await asyncio.sleep(1)
+
+    async def _broadcast(self, payload):
+        clients = list(self.clients)
+        results = await asyncio.gather(
+            *(websocket.send_text(payload) for websocket in clients), return_exceptions=True
+        )
+        for websocket, result in zip(clients, results):
+            if isinstance(result, Exception):
+                self.clients.discard(websocket)
+
+
+broadcaster = TaskEventBroadcaster()
+
 @router.websocket("/ws/tasks")
-async def websocket_tasks(websocket: WebSocket):
+async def websocket_tasks(websocket: WebSocket, limit: int = 100):
     await websocket.accept()
     try:
+        # 先登記連線再讀取快照，讀取期間發生的狀態變化不會遺失；客戶端依任務 ID 合併重複的變化
+        broadcaster.clients.add(websocket)
+        broadcaster.ensure_started()
+        tasks, total = await fetch_task_page(0, limit)
+        await websocket.send_text(json.dumps({"type": "snapshot", "tasks": tasks, "total": total}))
         while True:
-            task_ids = redis_client.smembers('task_ids')
-            tasks = []
-            for task_id in task_ids:
-                task = AsyncResult(task_id, app=celery_app)
-                task_data = {
-                    "task_id": task_id,
-                    "status": task.state,
-                    "node": task.info.get("node", "unknown") if task.info else "unknown"
-                }
-                if task.ready():
-                    task_data["result"] = task.result if task.state == "SUCCESS" else None
-                    task_data["error"] = task.info.get("error", None) if task.state == "FAILED" else None
-                tasks.append(task_data)
-            
-            logger.debug("WebSocket 推送任務列表，數量: %d，狀態: %s", 
-                        len(tasks), 
-                        {task["task_id"]: task["status"] for task in tasks})
-            await websocket.send_text(json.dumps({"tasks": tasks}))
-            await asyncio.sleep(1)
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        logger.debug("任務 WebSocket 連線已關閉: %s", websocket.client)
     except Exception as e:
         logger.exception("WebSocket 錯誤: %s", str(e))
+        await websocket.close()
     finally:
-        await websocket.close()
\ No newline at end of file
+        broadcaster.clients.discard(websocket)
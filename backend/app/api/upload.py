@@ -1,5 +1,12 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from starlette.concurrency import run_in_threadpool
 from ..celery_config import upload_task
+from ..services import staging
+from ..services.async_redis import get_async_redis
+from ..services.load_router import choose_ingest_queue, INGEST_QUEUE
+from ..services.tenants import collection_for, allow_request, TENANT_UPLOAD_RATE_LIMIT
+from typing import Optional
+import os
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
@@ -7,22 +14,60 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# 每次從上傳串流讀取並寫入暫存區的位元組數
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+async def spool_upload(file, staged_name):
+    """將上傳檔案分塊寫入共用暫存區，不在記憶體中保留整個檔案"""
+    size = 0
+    f = await run_in_threadpool(staging.open_for_write, staged_name)
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            await run_in_threadpool(f.write, chunk)
+            size += len(chunk)
+    finally:
+        await run_in_threadpool(f.close)
+    await run_in_threadpool(staging.commit, staged_name)
+    return size
+
 @router.get("/upload")
 async def get_upload():
     return {"message": "Please use POST method to upload a CSV file"}
 
 @router.post("/upload")
-async def upload_csv(file: UploadFile = File(...)):
-    logger.debug("收到上傳請求，檔案名稱: %s", file.filename)
+async def upload_csv(file: UploadFile = File(...), tenant: Optional[str] = Form(None)):
+    logger.debug("收到上傳請求，檔案名稱: %s，租戶: %s", file.filename, tenant)
     if file.content_type != "text/csv":
         logger.error("無效的檔案類型: %s", file.content_type)
         raise HTTPException(status_code=400, detail="僅支援 CSV 檔案")
-    
     try:
-        content = await file.read()
-        logger.debug("檔案大小: %d bytes", len(content))
-        task = upload_task.delay(content)
+        collection_name = collection_for(tenant)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        allowed = await allow_request(get_async_redis(), tenant, "upload", TENANT_UPLOAD_RATE_LIMIT)
+    except Exception as e:
+        logger.warning("檢查租戶上傳頻率失敗: %s", str(e))
+        allowed = True
+    if not allowed:
+        raise HTTPException(status_code=429, detail="此租戶的上傳次數已超過每分鐘上限")
+
+    staged_name = staging.new_staged_name()
+    try:
+        size = await spool_upload(file, staged_name)
+        logger.debug("檔案大小: %d bytes，暫存為 %s", size, staged_name)
+        try:
+            queue = await choose_ingest_queue(get_async_redis())
+        except Exception as e:
+            logger.warning("讀取節點負載失敗，改用共用佇列: %s", str(e))
+            queue = INGEST_QUEUE
+        logger.debug("上傳任務送往佇列 %s", queue)
+        task = upload_task.apply_async(args=[staged_name, collection_name], queue=queue)
         return {"task_id": task.id, "message": "任務已提交到隊列"}
     except Exception as e:
+        staging.remove(staged_name)
         logger.exception("提交任務失敗: %s", str(e))
         raise HTTPException(status_code=500, detail=f"提交任務失敗: {str(e)}")
\ No newline at end of file
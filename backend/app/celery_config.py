@@ -1,11 +1,24 @@
-from celery import Celery
-from .services.qdrant_client import QdrantService
-from .services.csv_processor import process_csv
+from celery import Celery, Task, chord, group
+from celery.signals import (
+    worker_process_init, before_task_publish, after_task_publish,
+    task_prerun, task_success, task_failure, task_retry
+)
+from .services import service_registry
+from .services.csv_processor import iter_csv_records, count_csv_rows
+from .services import staging
+from .services.ingest_journal import IngestionJournal, remove_journal
+from .services.task_events import register_task, publish_task_event
+from .services.metrics import observe_stage
+from .services.load_router import QUERY_QUEUE, INGEST_QUEUE
+from .services.tenants import DEFAULT_COLLECTION
+from .services import batch_queries
+from .services.result_store import compact_hits, RESULT_SERIALIZER, RESULT_EXPIRES_SECONDS
 import os
 import redis
 import psutil
 import logging
 import json
+import time
 
 # 配置日誌
 logging.basicConfig(level=logging.DEBUG)
@@ -19,48 +32,383 @@ redis_client = redis.Redis(
     decode_responses=True
 )
 
+class InstrumentedTask(Task):
+    """記錄任務本體耗時，並標記本體結束時間以計算結果後端寫入耗時"""
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().__call__(*args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            observe_stage(f"task_body:{self.name.rsplit('.', 1)[-1]}", end - start)
+            self.request.body_finished_at = end
+
 # 初始化 Celery
 app = Celery(
     'rag_tasks',
     broker=os.getenv('CELERY_BROKER_URL', 'redis://redis:6379/0'),
-    backend=os.getenv('CELERY_RESULT_BACKEND', 'redis://redis:6379/0')
+    backend=os.getenv('CELERY_RESULT_BACKEND', 'redis://redis:6379/0'),
+    task_cls=InstrumentedTask
 )
 
 app.conf.update(
     task_serializer='json',
     accept_content=['json'],
-    result_serializer='json',
+    # 結果後端只保存精簡後的結果並設定 TTL，避免 Redis 記憶體隨任務數持續成長
+    result_serializer=RESULT_SERIALIZER,
+    result_accept_content=[RESULT_SERIALIZER],
+    result_expires=RESULT_EXPIRES_SECONDS,
     timezone='UTC',
     enable_utc=True,
+    # 查詢與上傳分流到不同佇列，避免大型上傳佔滿 worker 而拖慢查詢
+    task_routes={
+        'app.celery_config.query_task': {'queue': QUERY_QUEUE},
+        'app.celery_config.upload_task': {'queue': INGEST_QUEUE},
+        # 分片送往共用佇列，讓所有節點的 ingest worker 一起分擔同一個大檔案
+        'app.celery_config.ingest_shard': {'queue': INGEST_QUEUE},
+        'app.celery_config.finalize_upload': {'queue': INGEST_QUEUE},
+        # 批次查詢屬於大量背景工作，與上傳共用 ingest 佇列，不佔用即時查詢的 worker
+        'app.celery_config.batch_query_task': {'queue': INGEST_QUEUE},
+        'app.celery_config.batch_query_chunk': {'queue': INGEST_QUEUE},
+        'app.celery_config.finalize_batch_query': {'queue': INGEST_QUEUE},
+    },
+    task_default_queue=QUERY_QUEUE,
 )
 
-@app.task(bind=True)
-def upload_task(self, file_content):
+# 上傳任務遇到非資料錯誤時的自動重試次數，重試會從日誌的最後提交批次續傳
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "3"))
+# 超過此列數的上傳會依列範圍拆成多個分片平行處理
+SHARD_MIN_ROWS = int(os.getenv("SHARD_MIN_ROWS", "20000"))
+SHARD_ROWS = int(os.getenv("SHARD_ROWS", "10000"))
+# 分片任務 (上傳與批次查詢) 的彙總進度：rows_total / shards_total / rows_done / shards_done
+TASK_PROGRESS_PREFIX = "task_progress:"
+
+NODE_NAME = f"node{os.getenv('PORT', 'unknown')[-1]}"
+TASK_LATENCY_PREFIX = "task_latency:"
+# 是否在每個 worker 子行程啟動時預先載入模型與連線
+WARMUP_ON_START = os.getenv("WORKER_WARMUP", "1") == "1"
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    # prefork 子行程不能共用父行程的 HTTP 連線，重新建立後再預熱
+    service_registry.reset_connections()
+    if WARMUP_ON_START:
+        try:
+            service_registry.warmup()
+        except Exception as e:
+            # 預熱失敗不應阻止 worker 啟動，第一個任務會再嘗試延遲載入
+            logger.exception("worker 預熱失敗: %s", str(e))
+
+def record_task_latency(task_name, seconds, cold):
+    """將任務延遲依冷/熱啟動分類累加到 Redis，供 /api/nodes/latency 查詢"""
+    kind = "cold" if cold else "warm"
+    key = f"{TASK_LATENCY_PREFIX}{NODE_NAME}"
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hincrby(key, f"{task_name}:{kind}:count", 1)
+        pipe.hincrbyfloat(key, f"{task_name}:{kind}:seconds", seconds)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("記錄任務延遲失敗: %s", str(e))
+
+def _ingest_rows(staged_name, journal_id, collection_name, start=0, stop=None, on_commit=None):
+    """將暫存檔 [start, stop) 範圍的列寫入指定集合，回傳統計與已提交列數"""
+    # 只透過 broker 傳遞暫存檔名，worker 從共用暫存區逐區塊讀取
+    records = iter_csv_records(staging.resolve(staged_name), start=start, stop=stop)
+    journal = IngestionJournal(journal_id)
+    qdrant_service = service_registry.get_qdrant_service(collection_name)
+    try:
+        stats = qdrant_service.store_data(records, journal=journal, on_commit=on_commit)
+    finally:
+        journal.close()
+    stats["records"] = journal.committed_rows
+    # 全部寫入後不再需要續傳紀錄；失敗時保留，重試才能從最後提交的批次繼續
+    journal.remove()
+    return stats
+
+def _discard_upload(staged_name, shards_total=0):
+    """上傳結束 (成功或最終失敗) 後移除暫存檔與所有續傳日誌"""
+    staging.remove(staged_name)
+    upload_id = os.path.splitext(staged_name)[0]
+    remove_journal(upload_id)
+    for shard_no in range(shards_total):
+        remove_journal(f"{upload_id}-s{shard_no}")
+
+def _invalidate_query_cache(collection_name):
+    # 即使中途失敗也可能已寫入部分批次，一律讓該集合舊的查詢結果快取失效
+    query_cache = service_registry.get_query_cache()
+    if query_cache is not None:
+        query_cache.bump_version(collection_name)
+
+def _upload_result(stats):
+    return {
+        "message": "檔案上傳成功，已儲存到知識庫",
+        "records": stats["records"],
+        "new": stats["new"],
+        "updated": stats["updated"],
+        "unchanged": stats["unchanged"],
+        "cache_hits": stats["cache_hits"],
+    }
+
+def _shard_ranges(total_rows, shard_rows=SHARD_ROWS):
+    return [(start, min(start + shard_rows, total_rows)) for start in range(0, total_rows, shard_rows)]
+
+def _start_progress(task, parent_id, rows_total, shards_total):
+    progress_key = f"{TASK_PROGRESS_PREFIX}{parent_id}"
+    pipe = redis_client.pipeline()
+    pipe.delete(progress_key)
+    pipe.hset(progress_key, mapping={
+        "rows_total": rows_total, "shards_total": shards_total, "rows_done": 0, "shards_done": 0
+    })
+    # 父任務中途失敗時 finalize 不會執行，進度與任務結果一起過期
+    pipe.expire(progress_key, RESULT_EXPIRES_SECONDS)
+    pipe.execute()
+    _report_progress(task, parent_id)
+
+def _report_progress(task, parent_id, rows=0, shard_done=False):
+    """累加分片進度，並以父任務 ID 寫入 PROGRESS 狀態供任務管理員顯示"""
+    key = f"{TASK_PROGRESS_PREFIX}{parent_id}"
+    pipe = redis_client.pipeline()
+    if rows:
+        pipe.hincrby(key, "rows_done", rows)
+    if shard_done:
+        pipe.hincrby(key, "shards_done", 1)
+    pipe.hgetall(key)
+    progress = {field: int(value) for field, value in pipe.execute()[-1].items()}
+    meta = {"node": os.getenv('PORT', 'unknown'), **progress}
+    task.update_state(task_id=parent_id, state="PROGRESS", meta=meta)
+    publish_task_event(redis_client, parent_id, "PROGRESS", meta["node"], progress=progress)
+
+# acks_late：worker 中途終止時任務會重新投遞，並從日誌的最後提交批次續傳
+@app.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def upload_task(self, staged_name, collection_name=DEFAULT_COLLECTION):
     logger.debug("執行上傳任務: %s", self.request.id)
+    start = time.perf_counter()
+    cold = not service_registry.is_warm()
+    # 以暫存檔名作為上傳 ID，重試時可找回同一份日誌
+    upload_id = os.path.splitext(staged_name)[0]
     try:
-        # 儲存任務 ID 到 Redis 集合
-        redis_client.sadd('task_ids', self.request.id)
         self.update_state(state='RUNNING', meta={'node': os.getenv('PORT', 'unknown')})
-        data_list = process_csv(file_content)
-        qdrant_service = QdrantService()
-        qdrant_service.store_data(data_list)
-        return {"message": "檔案上傳成功，已儲存到知識庫", "records": len(data_list)}
+        total_rows = count_csv_rows(staging.resolve(staged_name))
+        if total_rows <= SHARD_MIN_ROWS:
+            try:
+                stats = _ingest_rows(staged_name, upload_id, collection_name)
+            finally:
+                _invalidate_query_cache(collection_name)
+            staging.remove(staged_name)
+            record_task_latency("upload", time.perf_counter() - start, cold)
+            return _upload_result(stats)
     except Exception as e:
         logger.exception("上傳任務失敗: %s", str(e))
+        # 資料格式錯誤重試也無用；其他錯誤 (例如 Qdrant 暫時不可用) 保留暫存檔並重試
+        if not isinstance(e, ValueError) and self.request.retries < UPLOAD_MAX_RETRIES:
+            raise self.retry(exc=e, countdown=2 ** self.request.retries)
+        # 不會再重試，暫存檔與日誌已無用處
+        _discard_upload(staged_name)
         self.update_state(state='FAILED', meta={'error': str(e)})
         raise
 
+    # 大檔案：拆成列範圍分片平行處理，finalize_upload 以本任務 ID 寫入最終結果
+    ranges = _shard_ranges(total_rows)
+    logger.info("上傳 %s 共 %d 列，拆成 %d 個分片", upload_id, total_rows, len(ranges))
+    _start_progress(self, self.request.id, total_rows, len(ranges))
+    shards = group(
+        ingest_shard.s(staged_name, shard_no, shard_start, shard_stop, self.request.id, collection_name)
+        for shard_no, (shard_start, shard_stop) in enumerate(ranges)
+    )
+    # 任一分片或 finalize_upload 最終失敗時由 cleanup_upload 清除暫存檔
+    finalize = finalize_upload.s(staged_name, self.request.id, collection_name).on_error(
+        cleanup_upload.s(staged_name, self.request.id, len(ranges))
+    )
+    return self.replace(chord(shards, finalize))
+
+# 每個分片有自己的日誌與重試次數，失敗只會重跑該分片並從其最後提交批次續傳
+@app.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def ingest_shard(self, staged_name, shard_no, start_row, stop_row, parent_id, collection_name=DEFAULT_COLLECTION):
+    logger.debug("執行上傳分片 %d [%d, %d): %s", shard_no, start_row, stop_row, parent_id)
+    journal_id = f"{os.path.splitext(staged_name)[0]}-s{shard_no}"
+    try:
+        stats = _ingest_rows(
+            staged_name, journal_id, collection_name, start_row, stop_row,
+            on_commit=lambda rows: _report_progress(self, parent_id, rows)
+        )
+        _report_progress(self, parent_id, shard_done=True)
+        return stats
+    except Exception as e:
+        logger.exception("上傳分片 %d 失敗: %s", shard_no, str(e))
+        if not isinstance(e, ValueError) and self.request.retries < UPLOAD_MAX_RETRIES:
+            raise self.retry(exc=e, countdown=2 ** self.request.retries)
+        # 分片最終失敗時 chord 不會執行 finalize_upload，由此處讓父任務顯示失敗
+        _invalidate_query_cache(collection_name)
+        self.update_state(task_id=parent_id, state='FAILED', meta={'error': f"分片 {shard_no} 失敗: {str(e)}"})
+        publish_task_event(redis_client, parent_id, "FAILURE", os.getenv('PORT', 'unknown'),
+                           error=f"分片 {shard_no} 失敗: {str(e)}")
+        raise
+
+@app.task(bind=True)
+def finalize_upload(self, shard_results, staged_name, parent_id, collection_name=DEFAULT_COLLECTION):
+    """所有分片完成後彙總統計、讓查詢快取失效並清除暫存檔"""
+    logger.debug("彙總上傳結果: %s", parent_id)
+    stats = {
+        key: sum(result[key] for result in shard_results)
+        for key in ("records", "new", "updated", "unchanged", "cache_hits")
+    }
+    _invalidate_query_cache(collection_name)
+    _discard_upload(staged_name, len(shard_results))
+    redis_client.delete(f"{TASK_PROGRESS_PREFIX}{parent_id}")
+    return _upload_result(stats)
+
+@app.task
+def cleanup_upload(request, exc, traceback, staged_name, parent_id, shards_total):
+    """分片上傳 chord 的錯誤回呼：清除暫存檔、各分片日誌與進度"""
+    logger.warning("上傳 %s 失敗，清除暫存檔 %s: %s", parent_id, staged_name, str(exc))
+    _discard_upload(staged_name, shards_total)
+    redis_client.delete(f"{TASK_PROGRESS_PREFIX}{parent_id}")
+
 @app.task(bind=True)
-def query_task(self, query_text):
+def query_task(self, query_text, hnsw_ef=None, exact=None, collection_name=DEFAULT_COLLECTION, filters=None):
     logger.debug("執行查詢任務: %s", self.request.id)
+    start = time.perf_counter()
+    cold = not service_registry.is_warm()
     try:
-        # 儲存任務 ID 到 Redis 集合
-        redis_client.sadd('task_ids', self.request.id)
         self.update_state(state='RUNNING', meta={'node': os.getenv('PORT', 'unknown')})
-        qdrant_service = QdrantService()
-        results = qdrant_service.query(query_text, limit=5)
-        return {"results": results}
+        qdrant_service = service_registry.get_qdrant_service(collection_name)
+        results = qdrant_service.query(query_text, limit=5, hnsw_ef=hnsw_ef, exact=exact, filters=filters)
+        record_task_latency("query", time.perf_counter() - start, cold)
+        return {"results": compact_hits(results)}
     except Exception as e:
         logger.exception("查詢任務失敗: %s", str(e))
         self.update_state(state='FAILED', meta={'error': str(e)})
-        raise
\ No newline at end of file
+        raise
+
+@app.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def batch_query_task(self, staged_name, collection_name=DEFAULT_COLLECTION, filters=None, limit=5):
+    """批次查詢：正規化查詢檔後拆成多個子任務，各自以 query_batch 大批編碼與搜尋"""
+    logger.debug("執行批次查詢任務: %s", self.request.id)
+    queries_name = f"{os.path.splitext(staged_name)[0]}.queries.ndjson"
+    try:
+        self.update_state(state='RUNNING', meta={'node': os.getenv('PORT', 'unknown')})
+        total = batch_queries.normalize_queries(staging.resolve(staged_name), staging.resolve(queries_name))
+        staging.remove(staged_name)
+        if total == 0:
+            raise ValueError("沒有可執行的查詢")
+    except Exception as e:
+        logger.exception("批次查詢任務失敗: %s", str(e))
+        if not isinstance(e, ValueError) and self.request.retries < UPLOAD_MAX_RETRIES:
+            raise self.retry(exc=e, countdown=2 ** self.request.retries)
+        # 不會再重試，移除上傳的查詢檔與正規化到一半的輸出
+        staging.remove(staged_name)
+        staging.remove(queries_name)
+        self.update_state(state='FAILED', meta={'error': str(e)})
+        raise
+
+    ranges = _shard_ranges(total, batch_queries.BATCH_QUERY_CHUNK_SIZE)
+    logger.info("批次查詢 %s 共 %d 個查詢，拆成 %d 個子任務", self.request.id, total, len(ranges))
+    _start_progress(self, self.request.id, total, len(ranges))
+    chunks = group(
+        batch_query_chunk.s(queries_name, chunk_no, chunk_start, chunk_stop, self.request.id,
+                            collection_name, filters, limit)
+        for chunk_no, (chunk_start, chunk_stop) in enumerate(ranges)
+    )
+    # 任一子任務或 finalize_batch_query 最終失敗時由 cleanup_batch_query 清除輸入與部分結果
+    finalize = finalize_batch_query.s(queries_name, self.request.id).on_error(
+        cleanup_batch_query.s(queries_name, self.request.id, len(ranges))
+    )
+    return self.replace(chord(chunks, finalize))
+
+@app.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def batch_query_chunk(self, queries_name, chunk_no, start_row, stop_row, parent_id,
+                      collection_name=DEFAULT_COLLECTION, filters=None, limit=5):
+    logger.debug("執行批次查詢子任務 %d [%d, %d): %s", chunk_no, start_row, stop_row, parent_id)
+    try:
+        items = batch_queries.read_query_range(staging.resolve(queries_name), start_row, stop_row)
+        qdrant_service = service_registry.get_qdrant_service(collection_name)
+        lines = []
+        for offset in range(0, len(items), batch_queries.BATCH_QUERY_ENCODE_SIZE):
+            batch = items[offset:offset + batch_queries.BATCH_QUERY_ENCODE_SIZE]
+            results = qdrant_service.query_batch([item["query"] for item in batch], [limit] * len(batch), filters)
+            lines.extend(
+                {"id": item["id"], "query": item["query"], "results": hits}
+                for item, hits in zip(batch, results)
+            )
+        batch_queries.write_results_part(parent_id, chunk_no, lines)
+        # 子任務完成後才回報進度，重試時不會重複計算
+        _report_progress(self, parent_id, len(items), shard_done=True)
+        return len(items)
+    except Exception as e:
+        logger.exception("批次查詢子任務 %d 失敗: %s", chunk_no, str(e))
+        if not isinstance(e, ValueError) and self.request.retries < UPLOAD_MAX_RETRIES:
+            raise self.retry(exc=e, countdown=2 ** self.request.retries)
+        self.update_state(task_id=parent_id, state='FAILED', meta={'error': f"子任務 {chunk_no} 失敗: {str(e)}"})
+        publish_task_event(redis_client, parent_id, "FAILURE", os.getenv('PORT', 'unknown'),
+                           error=f"子任務 {chunk_no} 失敗: {str(e)}")
+        raise
+
+@app.task(bind=True)
+def finalize_batch_query(self, chunk_counts, queries_name, parent_id):
+    """串接各子任務的結果檔，結果可由 GET /api/query/batch/{task_id}/results 下載"""
+    logger.debug("彙總批次查詢結果: %s", parent_id)
+    batch_queries.merge_results(parent_id, len(chunk_counts))
+    staging.remove(queries_name)
+    redis_client.delete(f"{TASK_PROGRESS_PREFIX}{parent_id}")
+    return {
+        "message": "批次查詢完成",
+        "queries": sum(chunk_counts),
+        "results_url": f"/api/query/batch/{parent_id}/results",
+    }
+
+@app.task
+def cleanup_batch_query(request, exc, traceback, queries_name, parent_id, chunks_total):
+    """批次查詢 chord 的錯誤回呼：清除正規化後的查詢檔、部分結果與進度"""
+    logger.warning("批次查詢 %s 失敗，清除查詢檔 %s: %s", parent_id, queries_name, str(exc))
+    staging.remove(queries_name)
+    batch_queries.remove_result_parts(parent_id, chunks_total)
+    redis_client.delete(f"{TASK_PROGRESS_PREFIX}{parent_id}")
+
+# 出現在任務管理員中的任務；內部子任務不列出
+TRACKED_TASKS = {upload_task.name, query_task.name, batch_query_task.name}
+# finalize_upload / finalize_batch_query 沿用父任務的 ID 執行，其狀態變化即為父任務的狀態
+STATUS_TASKS = TRACKED_TASKS | {finalize_upload.name, finalize_batch_query.name}
+
+@before_task_publish.connect
+def on_before_task_publish(headers=None, **kwargs):
+    # 記錄發布時間，worker 端據此計算在 broker 中等待的時間
+    if headers is not None:
+        headers["published_at"] = time.time()
+
+@after_task_publish.connect
+def on_task_published(sender=None, headers=None, **kwargs):
+    # 在提交任務的行程中執行 (通常是 API)，讓排隊中的任務也能立即出現在列表
+    if sender in TRACKED_TASKS and headers:
+        try:
+            register_task(redis_client, headers["id"])
+        except Exception as e:
+            logger.warning("登記任務 %s 失敗: %s", headers.get("id"), str(e))
+
+@task_prerun.connect
+def on_task_prerun(sender=None, task_id=None, **kwargs):
+    published_at = getattr(sender.request, "published_at", None) if sender is not None else None
+    if published_at:
+        observe_stage("broker_wait", max(0.0, time.time() - published_at))
+    if sender is not None and sender.name in STATUS_TASKS:
+        publish_task_event(redis_client, task_id, "RUNNING", os.getenv('PORT', 'unknown'))
+
+@task_success.connect
+def on_task_success(sender=None, result=None, **kwargs):
+    # Celery 先將結果寫入結果後端，再送出 task_success 訊號
+    body_finished_at = getattr(sender.request, "body_finished_at", None) if sender is not None else None
+    if body_finished_at:
+        observe_stage("result_backend_write", time.perf_counter() - body_finished_at)
+    if sender is not None and sender.name in STATUS_TASKS:
+        publish_task_event(redis_client, sender.request.id, "SUCCESS", os.getenv('PORT', 'unknown'), result=result)
+
+@task_failure.connect
+def on_task_failure(sender=None, task_id=None, exception=None, **kwargs):
+    if sender is not None and sender.name in STATUS_TASKS:
+        publish_task_event(redis_client, task_id, "FAILURE", os.getenv('PORT', 'unknown'), error=str(exception))
+
+@task_retry.connect
+def on_task_retry(sender=None, request=None, reason=None, **kwargs):
+    if sender is not None and sender.name in STATUS_TASKS:
+        publish_task_event(redis_client, request.id, "RETRY", os.getenv('PORT', 'unknown'), error=str(reason))
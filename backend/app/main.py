@@ -1,10 +1,13 @@
 import os
-from fastapi import FastAPI
+import time
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from .api.upload import router as upload_router
 from .api.query import router as query_router
 from .api.task_manager import router as task_manager_router
 from .api.node_monitor import router as node_monitor_router
+from .celery_config import redis_client
+from .services.metrics import HTTP_REQUEST_SECONDS, NODE_NAME, render_metrics
 import logging
 
 # 配置日誌
@@ -23,6 +26,17 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # 以路由樣板作為標籤 (例如 /api/tasks/{task_id})，避免標籤數量隨任務 ID 成長
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.labels(
+        NODE_NAME, request.method, route.path if route else "unmatched", str(response.status_code)
+    ).observe(time.perf_counter() - start)
+    return response
+
 # 掛載路由
 app.include_router(upload_router, prefix="/api")
 app.include_router(query_router, prefix="/api")
@@ -32,4 +46,10 @@ app.include_router(node_monitor_router, prefix="/api")
 @app.get("/")
 async def root():
     port = os.getenv("PORT", "8000")
-    return {"message": f"Welcome to the Distributed RAG System API (Node on port {port})"}
\ No newline at end of file
+    return {"message": f"Welcome to the Distributed RAG System API (Node on port {port})"}
+
+@app.get("/metrics")
+def metrics():
+    # 同步端點在執行緒池中執行，讀取佇列深度不會阻塞事件迴圈
+    content, content_type = render_metrics(redis_client)
+    return Response(content=content, media_type=content_type)
@@ -0,0 +1,31 @@
+import redis.asyncio as aioredis
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+
+_pools = {}
+
+
+def get_async_redis(decode_responses=True):
+    """API 層共用的 asyncio Redis 客戶端；所有呼叫共用同一個連線池
+
+    decode_responses=False 回傳原始位元組，用於讀取 msgpack 等二進位格式的任務結果。
+    """
+    pool = _pools.get(decode_responses)
+    if pool is None:
+        pool = aioredis.ConnectionPool(
+            host=REDIS_HOST,
+            port=6379,
+            db=0,
+            decode_responses=decode_responses,
+            max_connections=REDIS_MAX_CONNECTIONS,
+        )
+        _pools[decode_responses] = pool
+        logger.debug("建立 asyncio Redis 連線池，上限 %d", REDIS_MAX_CONNECTIONS)
+    return aioredis.Redis(connection_pool=pool)
@@ -0,0 +1,144 @@
+from itertools import islice
+from .result_store import RESULT_EXPIRES_SECONDS
+import pandas as pd
+import shutil
+import time
+import json
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# 批次查詢結果存放在所有節點共用的 ./data volume，任何節點的 API 都能讀取
+BATCH_RESULTS_DIR = os.getenv("BATCH_RESULTS_DIR", os.path.join(os.getcwd(), "data", "batch_results"))
+# 每個子任務處理的查詢數，以及每次 query_batch (單次編碼 + 單次 search_batch) 的查詢數
+BATCH_QUERY_CHUNK_SIZE = int(os.getenv("BATCH_QUERY_CHUNK_SIZE", "2000"))
+BATCH_QUERY_ENCODE_SIZE = int(os.getenv("BATCH_QUERY_ENCODE_SIZE", "256"))
+BATCH_QUERY_MAX_LIMIT = int(os.getenv("BATCH_QUERY_MAX_LIMIT", "50"))
+
+# 上傳的查詢檔支援的格式
+QUERY_FILE_SUFFIXES = (".txt", ".csv", ".ndjson", ".jsonl")
+
+
+def _iter_raw_queries(path):
+    """依副檔名解析查詢檔，產生 (id, query)；id 未提供時使用從 0 起算的序號"""
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".csv":
+        index = 0
+        for chunk in pd.read_csv(path, chunksize=5000, dtype=str, encoding="utf-8-sig"):
+            if "query" not in chunk.columns:
+                raise ValueError("CSV 文件必須包含 'query' 欄位")
+            ids = chunk["id"] if "id" in chunk.columns else [None] * len(chunk)
+            for query_id, query in zip(ids, chunk["query"]):
+                yield (query_id if isinstance(query_id, str) else index), query
+                index += 1
+        return
+    with open(path, encoding="utf-8-sig") as f:
+        for index, line in enumerate(f):
+            line = line.strip()
+            if suffix in (".ndjson", ".jsonl"):
+                if not line:
+                    continue
+                item = json.loads(line)
+                if isinstance(item, dict):
+                    yield item.get("id", index), item.get("query")
+                else:
+                    yield index, item
+            else:
+                yield index, line
+
+
+def normalize_queries(src_path, dst_path):
+    """轉為每行 {"id", "query"} 的 NDJSON 並回傳查詢數；空白查詢會被略過"""
+    count = 0
+    with open(dst_path + ".part", "w", encoding="utf-8") as out:
+        for query_id, query in _iter_raw_queries(src_path):
+            if not isinstance(query, str) or not query.strip():
+                continue
+            out.write(json.dumps({"id": query_id, "query": query.strip()}, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(dst_path + ".part", dst_path)
+    return count
+
+
+def write_query_list(path, queries):
+    """將 JSON 請求中的查詢清單寫入暫存區，id 為清單中的位置"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".part", "w", encoding="utf-8") as out:
+        for index, query in enumerate(queries):
+            out.write(json.dumps({"id": index, "query": query}, ensure_ascii=False) + "\n")
+    os.replace(path + ".part", path)
+
+
+def read_query_range(path, start, stop):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in islice(f, start, stop)]
+
+
+def result_path(task_id, part=None):
+    """結果檔路徑；拒絕任何跳出結果目錄的任務 ID"""
+    if not task_id or os.path.basename(task_id) != task_id:
+        raise ValueError(f"無效的任務 ID: {task_id}")
+    name = f"{task_id}.ndjson" if part is None else f"{task_id}.part{part}.ndjson"
+    return os.path.join(BATCH_RESULTS_DIR, name)
+
+
+def write_results_part(task_id, part, lines):
+    """寫出一個子任務的結果；重試時整份覆寫，不會留下重複的行"""
+    os.makedirs(BATCH_RESULTS_DIR, exist_ok=True)
+    path = result_path(task_id, part)
+    with open(path + ".tmp", "w", encoding="utf-8") as out:
+        for line in lines:
+            out.write(json.dumps(line, ensure_ascii=False) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def merge_results(task_id, parts):
+    """依子任務順序串接為單一結果檔並刪除各部分"""
+    path = result_path(task_id)
+    with open(path + ".tmp", "wb") as out:
+        for part in range(parts):
+            with open(result_path(task_id, part), "rb") as f:
+                shutil.copyfileobj(f, out)
+    os.replace(path + ".tmp", path)
+    remove_result_parts(task_id, parts)
+    return path
+
+
+def remove_result_parts(task_id, parts):
+    """刪除各子任務的部分結果 (含寫到一半的暫存檔)"""
+    for part in range(parts):
+        for path in (result_path(task_id, part), result_path(task_id, part) + ".tmp"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("刪除批次查詢部分結果失敗: %s", str(e))
+
+
+def results_expired(path, max_age=RESULT_EXPIRES_SECONDS):
+    """結果檔與任務結果同時過期；過期後即使檔案尚未被清除也不再提供"""
+    return time.time() - os.path.getmtime(path) > max_age
+
+
+def remove_expired_results(max_age=RESULT_EXPIRES_SECONDS):
+    """刪除超過保留時間的結果檔 (含失敗任務留下的部分結果)，回傳刪除數量"""
+    removed = 0
+    try:
+        names = os.listdir(BATCH_RESULTS_DIR)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        path = os.path.join(BATCH_RESULTS_DIR, name)
+        try:
+            if results_expired(path, max_age):
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("刪除過期批次查詢結果 %s 失敗: %s", path, str(e))
+    return removed
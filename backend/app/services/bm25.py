@@ -0,0 +1,95 @@
+from qdrant_client.http.models import SparseVector
+from collections import Counter
+import unicodedata
+import zlib
+import re
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# 是否在上傳時建立 BM25 稀疏向量並在查詢時與向量搜尋融合
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+# 集合中稀疏向量的名稱；稠密向量維持未命名，既有的查詢與上傳程式不受影響
+SPARSE_VECTOR_NAME = "bm25"
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# 文件長度正規化使用的平均 token 數；IDF 由 Qdrant 依集合統計計算 (Modifier.IDF)
+BM25_AVG_DOC_LENGTH = float(os.getenv("BM25_AVG_DOC_LENGTH", "64"))
+# 融合前每種檢索各取的候選數，以及 RRF 的平滑常數
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# RRF 中稠密與 BM25 名次的權重；BM25 權重較高，只有 BM25 找到的精確關鍵字命中 (產品代碼、錯誤字串)
+# 不會排在只有向量搜尋找到的相似內容之後
+HYBRID_DENSE_WEIGHT = float(os.getenv("HYBRID_DENSE_WEIGHT", "1.0"))
+HYBRID_SPARSE_WEIGHT = float(os.getenv("HYBRID_SPARSE_WEIGHT", "1.5"))
+# 依 build_search_requests 的請求順序 (稠密、稀疏)
+HYBRID_WEIGHTS = (HYBRID_DENSE_WEIGHT, HYBRID_SPARSE_WEIGHT)
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_WORD_CHAR = rf"[^\W_{_CJK}]"
+# 產品代碼與錯誤字串 (例如 ab-1234、e_conn_refused、v2.1.3) 保留為完整 token，也拆出各段
+_TOKEN_PATTERN = re.compile(rf"(?P<word>{_WORD_CHAR}+(?:[-_./:]{_WORD_CHAR}+)*)|(?P<cjk>[{_CJK}]+)")
+_SPLIT_PATTERN = re.compile(r"[-_./:]")
+
+
+def tokenize(text):
+    """英數字以詞為單位，中日韓文字沒有空白分詞，改用相鄰字元的 bigram"""
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(unicodedata.normalize("NFKC", text).lower()):
+        word, cjk = match.group("word"), match.group("cjk")
+        if word:
+            tokens.append(word)
+            parts = _SPLIT_PATTERN.split(word)
+            if len(parts) > 1:
+                tokens.extend(parts)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+def _term_index(token):
+    # crc32 在不同行程間穩定 (Python 內建 hash 會隨機化)；極少數碰撞只會合併兩個詞的權重
+    return zlib.crc32(token.encode("utf-8"))
+
+
+def _sparse_vector(weights):
+    merged = {}
+    for token, weight in weights.items():
+        index = _term_index(token)
+        merged[index] = merged.get(index, 0.0) + weight
+    return SparseVector(indices=list(merged), values=list(merged.values()))
+
+
+def encode_document(text):
+    """BM25 的詞頻部分：tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))"""
+    counts = Counter(tokenize(text))
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * sum(counts.values()) / BM25_AVG_DOC_LENGTH)
+    return _sparse_vector({
+        token: tf * (BM25_K1 + 1) / (tf + length_norm) for token, tf in counts.items()
+    })
+
+
+def encode_query(text):
+    """查詢中每個相異詞權重為 1，乘上 Qdrant 計算的 IDF；沒有可用的詞時回傳 None"""
+    tokens = set(tokenize(text))
+    return _sparse_vector({token: 1.0 for token in tokens}) if tokens else None
+
+
+def reciprocal_rank_fusion(result_lists, limit, k=RRF_K, weights=None):
+    """依各清單中的名次融合：score = Σ weight / (k + rank)，回傳前 limit 筆 [(hit, score)]
+
+    weights 與 result_lists 一一對應，未提供時各清單權重為 1；limit 為 None 時回傳全部。
+    """
+    weights = weights or [1.0] * len(result_lists)
+    scores, hits = {}, {}
+    for results, weight in zip(result_lists, weights):
+        for rank, hit in enumerate(results, start=1):
+            scores[hit.id] = scores.get(hit.id, 0.0) + weight / (k + rank)
+            hits.setdefault(hit.id, hit)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [(hits[point_id], score) for point_id, score in ranked]
@@ -0,0 +1,70 @@
+from .qdrant_client import content_hash, point_id
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# 是否將超過模型長度的內容切成多個重疊的區塊；停用時超出的部分會被模型截斷
+CHUNKING_ENABLED = os.getenv("CHUNKING_ENABLED", "1") == "1"
+# 每個區塊的 token 數，0 表示使用模型最大長度扣除 [CLS]/[SEP]
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "0"))
+# 相鄰區塊重疊的 token 數，避免句子被切斷在區塊邊界而無法檢索
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+
+
+class Chunker:
+    """以嵌入模型的 tokenizer 做滑動視窗切塊，依 offset 對應回原文，不會改動原始文字"""
+
+    def __init__(self, tokenizer, max_tokens, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+        if not getattr(tokenizer, "is_fast", False):
+            raise ValueError("切塊需要支援 offset mapping 的 fast tokenizer")
+        if overlap_tokens >= max_tokens:
+            raise ValueError(f"重疊 token 數 ({overlap_tokens}) 必須小於區塊大小 ({max_tokens})")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.stride = max_tokens - overlap_tokens
+
+    def split(self, texts):
+        """回傳每段文字的區塊清單；未超過長度的文字只有一個區塊 (即原文)"""
+        encoded = self.tokenizer(
+            texts, add_special_tokens=False, return_offsets_mapping=True, verbose=False
+        )
+        chunks = []
+        for text, offsets in zip(texts, encoded["offset_mapping"]):
+            if len(offsets) <= self.max_tokens:
+                chunks.append([text])
+                continue
+            windows = []
+            for start in range(0, len(offsets), self.stride):
+                end = min(start + self.max_tokens, len(offsets))
+                windows.append(text[offsets[start][0]:offsets[end - 1][1]])
+                if end == len(offsets):
+                    break
+            chunks.append(windows)
+        return chunks
+
+    def expand(self, records):
+        """將一批列展開為區塊；被切開的列以 parent_id / chunk_index 記錄來源列"""
+        contents = [str(record["content"]) for record in records]
+        expanded = []
+        for record, content, windows in zip(records, contents, self.split(contents)):
+            if len(windows) == 1:
+                expanded.append(record)
+                continue
+            source = str(record.get("source", "csv_upload"))
+            # 父 ID 即為整列未切塊時的 point ID
+            parent_id = point_id(content_hash(content), source)
+            expanded.extend(
+                {"content": window, "source": source, "parent_id": parent_id, "chunk_index": index}
+                for index, window in enumerate(windows)
+            )
+        return expanded
+
+
+def create_chunker(vectorizer, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """依嵌入後端的 tokenizer 與最大長度建立切塊器；停用時回傳 None"""
+    if not CHUNKING_ENABLED:
+        return None
+    return Chunker(vectorizer.tokenizer, max_tokens or vectorizer.max_seq_length - 2, overlap_tokens)
@@ -0,0 +1,119 @@
+"""以新的集合設定檔重建既有集合，完成後將別名切換到新集合
+
+在 backend 目錄下執行 (遷移期間請暫停上傳，之後寫入的資料不會被複製):
+    python -m app.services.collection_migration --profile memory
+
+查詢與上傳一律使用集合名稱 KnowledgeBase；遷移後它成為指向實際集合的別名，
+之後的遷移在同一次 update_collection_aliases 中原子地切換別名，查詢不會中斷。
+Qdrant 不允許別名與既有的實體集合同名，因此第一次遷移 (名稱仍是實體集合時) 必須先刪除實體集合
+再建立別名，兩次呼叫之間的查詢會失敗；請在離峰時執行第一次遷移。
+遷移後會遞增集合版本，各 worker 會重新讀取集合設定 (例如是否有 BM25 稀疏向量)。
+"""
+from qdrant_client.http.models import (
+    PointStruct, CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation
+)
+from .collection_profiles import get_profile, collection_config, PROFILES
+from .tenants import ensure_payload_indexes
+from . import bm25
+from . import service_registry
+import argparse
+import time
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+
+def _with_bm25(vector, payload):
+    # 來源集合建立於混合檢索之前時，依 payload 內容補上 BM25 稀疏向量
+    if not bm25.HYBRID_SEARCH:
+        return vector
+    vectors = dict(vector) if isinstance(vector, dict) else {"": vector}
+    if bm25.SPARSE_VECTOR_NAME not in vectors:
+        vectors[bm25.SPARSE_VECTOR_NAME] = bm25.encode_document(str(payload.get("content", "")))
+    return vectors
+
+
+def _vector_dim(collection_info):
+    vectors = collection_info.config.params.vectors
+    return (vectors[""] if isinstance(vectors, dict) else vectors).size
+
+
+def migrate_collection(client, alias, profile_name, vector_dim=None, batch_size=512, keep_old=False):
+    """複製所有 point (含向量與 payload) 到以新設定檔建立的集合，回傳新集合名稱
+
+    vector_dim 未指定時沿用來源集合的向量維度，不需要載入嵌入模型。
+    """
+    profile = get_profile(profile_name)
+    aliases = {item.alias_name: item.collection_name for item in client.get_aliases().aliases}
+    source = aliases.get(alias, alias)
+    if not client.collection_exists(source):
+        raise ValueError(f"集合 {source} 不存在")
+    vector_dim = vector_dim or _vector_dim(client.get_collection(source))
+    target = f"{alias}__{profile_name}_{int(time.time())}"
+    logger.info("以設定檔 %s 建立集合 %s，來源 %s", profile_name, target, source)
+    client.create_collection(collection_name=target, **collection_config(profile, vector_dim))
+    ensure_payload_indexes(client, target)
+
+    copied, offset = 0, None
+    while True:
+        points, offset = client.scroll(
+            collection_name=source, limit=batch_size, offset=offset, with_payload=True, with_vectors=True
+        )
+        if points:
+            client.upsert(
+                collection_name=target,
+                points=[
+                    PointStruct(id=point.id, vector=_with_bm25(point.vector, point.payload), payload=point.payload)
+                    for point in points
+                ],
+                wait=True
+            )
+            copied += len(points)
+            logger.debug("已複製 %d 個 point", copied)
+        if offset is None:
+            break
+
+    expected = client.count(collection_name=source, exact=True).count
+    actual = client.count(collection_name=target, exact=True).count
+    if actual != expected:
+        raise RuntimeError(f"複製後數量不一致: 來源 {expected}，目標 {actual}；新集合 {target} 已保留供檢查")
+
+    create = CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=alias))
+    if alias in aliases:
+        client.update_collection_aliases(change_aliases_operations=[
+            DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=alias)), create
+        ])
+        if not keep_old:
+            client.delete_collection(source)
+    else:
+        # 第一次遷移：Qdrant 不允許別名與實體集合同名，必須先刪除實體集合才能建立別名。
+        # 兩個呼叫緊接執行以縮短名稱無法解析的時間；之後的遷移只切換別名，不會再有空窗
+        logger.warning("第一次遷移 %s：刪除實體集合並建立別名期間查詢會短暫失敗", alias)
+        client.delete_collection(source)
+        client.update_collection_aliases(change_aliases_operations=[create])
+    logger.info("別名 %s 已指向 %s，共 %d 個 point", alias, target, copied)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以新的集合設定檔重建集合")
+    parser.add_argument("--profile", required=True, choices=sorted(PROFILES))
+    parser.add_argument("--collection", default="KnowledgeBase")
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--keep-old", action="store_true", help="保留舊的實體集合 (第一次遷移時無效)")
+    args = parser.parse_args()
+    # 只搬移既有的向量，不需要載入嵌入模型
+    client = service_registry.get_qdrant_client()
+    target = migrate_collection(client, args.collection, args.profile, batch_size=args.batch_size,
+                                keep_old=args.keep_old)
+    # 遞增集合版本：查詢結果快取失效，各 worker 也會重新讀取集合設定 (例如是否有 BM25 稀疏向量)
+    query_cache = service_registry.get_query_cache()
+    if query_cache is not None:
+        query_cache.bump_version(args.collection)
+    print(f"{args.collection} -> {target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+from qdrant_client.http.models import (
+    Distance, VectorParams, HnswConfigDiff, ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    ProductQuantization, ProductQuantizationConfig, CompressionRatio, SearchParams, QuantizationSearchParams,
+    SparseVectorParams, SparseIndexParams, Modifier
+)
+from .bm25 import HYBRID_SEARCH, SPARSE_VECTOR_NAME
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# 建立集合與查詢時使用的設定檔名稱
+COLLECTION_PROFILE = os.getenv("COLLECTION_PROFILE", "default")
+
+# 所有設定檔共用的預設值；HNSW 的 m / ef_construct 與 Qdrant 預設相同
+_BASE_PROFILE = {
+    "quantization": None,        # None / "scalar" (int8，約 4 倍壓縮) / "product" (PQ，x16)
+    "quantized_in_ram": True,    # 量化後的向量常駐記憶體，原始向量可放在磁碟
+    "on_disk": False,            # 原始 float32 向量以 mmap 放在磁碟
+    "on_disk_payload": False,    # payload 放在磁碟，只在回傳結果時讀取
+    "hnsw_m": 16,
+    "hnsw_ef_construct": 100,
+    "hnsw_ef": None,             # 查詢時的 ef，None 表示使用 Qdrant 預設 (等於 ef_construct)
+    "exact": False,              # 略過索引做完整掃描，用於量測召回率的基準
+    "rescore": True,             # 以原始向量重新計分量化搜尋的候選
+    "oversampling": 2.0,         # 量化搜尋時多取的候選倍數
+}
+
+PROFILES = {
+    # 原本的行為：float32 向量與 payload 都在記憶體中
+    "default": {},
+    # int8 純量量化，原始向量仍在記憶體中供重新計分
+    "balanced": {"quantization": "scalar", "hnsw_ef": 128},
+    # 只有 int8 向量與 HNSW 圖常駐記憶體，原始向量與 payload 放在磁碟
+    "memory": {"quantization": "scalar", "on_disk": True, "on_disk_payload": True, "hnsw_ef": 128},
+    # PQ 壓縮率最高但召回率較低，以較大的 oversampling 補償
+    "compact": {
+        "quantization": "product", "on_disk": True, "on_disk_payload": True,
+        "hnsw_ef": 128, "oversampling": 3.0,
+    },
+}
+
+
+def get_profile(name=None):
+    """回傳合併預設值後的設定檔；可用 QDRANT_HNSW_M 等環境變數覆寫單一欄位"""
+    name = name or COLLECTION_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"未知的集合設定檔: {name}，可用: {', '.join(PROFILES)}")
+    profile = {**_BASE_PROFILE, **PROFILES[name], "name": name}
+    for key, cast in (("hnsw_m", int), ("hnsw_ef_construct", int), ("hnsw_ef", int), ("oversampling", float)):
+        override = os.getenv(f"QDRANT_{key.upper()}")
+        if override:
+            profile[key] = cast(override)
+    return profile
+
+
+def _quantization_config(profile):
+    if profile["quantization"] == "scalar":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(
+            type=ScalarType.INT8, quantile=0.99, always_ram=profile["quantized_in_ram"]
+        ))
+    if profile["quantization"] == "product":
+        return ProductQuantization(product=ProductQuantizationConfig(
+            compression=CompressionRatio.X16, always_ram=profile["quantized_in_ram"]
+        ))
+    return None
+
+
+def collection_config(profile, vector_dim, hybrid=HYBRID_SEARCH):
+    """create_collection 的參數 (不含集合名稱)；hybrid 時另建 BM25 稀疏向量，IDF 由 Qdrant 計算"""
+    sparse_vectors_config = None
+    if hybrid:
+        sparse_vectors_config = {SPARSE_VECTOR_NAME: SparseVectorParams(
+            index=SparseIndexParams(on_disk=profile["on_disk"]), modifier=Modifier.IDF
+        )}
+    return {
+        "vectors_config": VectorParams(size=vector_dim, distance=Distance.COSINE, on_disk=profile["on_disk"]),
+        "hnsw_config": HnswConfigDiff(m=profile["hnsw_m"], ef_construct=profile["hnsw_ef_construct"]),
+        "quantization_config": _quantization_config(profile),
+        "on_disk_payload": profile["on_disk_payload"],
+        "sparse_vectors_config": sparse_vectors_config,
+    }
+
+
+def search_params(profile, hnsw_ef=None, exact=None):
+    """查詢參數；hnsw_ef / exact 可逐次查詢覆寫設定檔的值"""
+    exact = profile["exact"] if exact is None else exact
+    quantization = None
+    if profile["quantization"] is not None:
+        quantization = QuantizationSearchParams(rescore=profile["rescore"], oversampling=profile["oversampling"])
+    return SearchParams(
+        hnsw_ef=hnsw_ef or profile["hnsw_ef"],
+        exact=exact,
+        # 完整掃描時不使用量化向量，結果即為精確的基準
+        quantization=QuantizationSearchParams(ignore=True) if exact and quantization else quantization,
+    )
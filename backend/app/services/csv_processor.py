@@ -1,39 +1,91 @@
 import pandas as pd
 from io import StringIO
+from .metrics import observe_stage
+import time
+import os
 import logging
 
 # 配置日誌
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# 串流解析時每次讀入的列數
+CSV_CHUNK_SIZE = int(os.getenv("CSV_CHUNK_SIZE", "5000"))
+
+
+def _normalize_chunk(df):
+    """以欄位向量運算清理一個 DataFrame 區塊，回傳非空內容的記錄"""
+    # 確保 content 欄位存在
+    if "content" not in df.columns:
+        logger.error("CSV 缺少 'content' 欄位")
+        raise ValueError("CSV 必須包含 'content' 欄位")
+
+    contents = df["content"].fillna("").astype(str).str.strip()
+    if "source" in df.columns:
+        sources = df["source"].fillna("csv_upload").astype(str).str.strip()
+    else:
+        sources = pd.Series("csv_upload", index=df.index)
+
+    mask = contents != ""  # 僅處理非空內容
+    return [
+        {"content": content, "source": source}
+        for content, source in zip(contents[mask], sources[mask])
+    ]
+
+
+def count_csv_rows(path, chunksize=CSV_CHUNK_SIZE):
+    """計算資料列數 (不含標題)，只解析第一欄以減少成本
+
+    空白行也計入，與 iter_csv_records 的 skiprows 使用同一套列編號，分片邊界才不會錯位。
+    """
+    reader = pd.read_csv(path, chunksize=chunksize, usecols=[0], dtype=str, encoding="utf-8-sig",
+                         skip_blank_lines=False)
+    return sum(len(chunk) for chunk in reader)
+
+
+def iter_csv_records(path, chunksize=CSV_CHUNK_SIZE, start=0, stop=None):
+    """逐區塊解析 CSV 檔案，記憶體用量只與 chunksize 有關，與檔案大小無關
+
+    start/stop 為資料列 (不含標題，空白行也算一列) 的範圍，供分片上傳只讀取自己負責的區段。
+    """
+    logger.debug("開始串流解析 CSV: %s [%d, %s)", path, start, stop)
+    total = 0
+    # 以函式略過列，避免為數百萬列建立略過清單；標題列 (第 0 列) 保留
+    skiprows = (lambda i, skip=start: 0 < i <= skip) if start else None
+    nrows = stop - start if stop is not None else None
+    try:
+        reader = pd.read_csv(path, chunksize=chunksize, dtype=str, encoding="utf-8-sig",
+                             skiprows=skiprows, nrows=nrows, skip_blank_lines=False)
+        while True:
+            t0 = time.perf_counter()
+            chunk = next(reader, None)
+            if chunk is None:
+                break
+            records = _normalize_chunk(chunk)
+            observe_stage("csv_parse_chunk", time.perf_counter() - t0)
+            total += len(records)
+            yield from records
+    except Exception as e:
+        logger.exception("CSV 解析失敗: %s", str(e))
+        raise
+    logger.debug("串流解析完成，共 %d 條數據", total)
+
+
 def process_csv(file_content):
     try:
         # 將檔案內容轉為字符串
-        content = file_content.decode("utf-8")
+        content = file_content.decode("utf-8-sig")
         logger.debug("開始解析 CSV 內容")
-        
+
         # 使用 pandas 解析 CSV
-        df = pd.read_csv(StringIO(content))
+        df = pd.read_csv(StringIO(content), dtype=str)
         logger.debug("CSV 欄位: %s", df.columns.tolist())
-        
-        # 確保 content 欄位存在
-        if "content" not in df.columns:
-            logger.error("CSV 缺少 'content' 欄位")
-            raise ValueError("CSV 必須包含 'content' 欄位")
-        
+
         # 清理數據，轉為字符串並移除空值
-        data_list = []
-        for _, row in df.iterrows():
-            content = str(row["content"]).strip() if pd.notna(row["content"]) else ""
-            if content:  # 僅處理非空內容
-                data_list.append({
-                    "content": content,
-                    "source": str(row.get("source", "csv_upload")).strip()
-                })
-        
+        data_list = _normalize_chunk(df)
+
         logger.debug("解析完成，生成 %d 條數據", len(data_list))
-        logger.debug(data_list)
         return data_list
     except Exception as e:
         logger.exception("CSV 解析失敗: %s", str(e))
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,117 @@
+from concurrent.futures import ThreadPoolExecutor
+from .qdrant_client import build_search_requests, merge_search_results, hybrid_enabled, CHUNK_QUERY_OVERSAMPLING
+from .chunking import CHUNKING_ENABLED
+from .tenants import DEFAULT_COLLECTION, build_filter, filter_key
+from . import bm25
+from .metrics import stage_timer
+from .collection_profiles import get_profile, search_params
+import asyncio
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# API 行程內同時執行的直接查詢上限，超過時改走 Celery
+DIRECT_QUERY_MAX_INFLIGHT = int(os.getenv("DIRECT_QUERY_MAX_INFLIGHT", "8"))
+# 執行嵌入模型的執行緒數；PyTorch 在運算時會釋放 GIL
+EMBED_POOL_WORKERS = int(os.getenv("EMBED_POOL_WORKERS", "2"))
+
+
+class DirectQueryService:
+    """在 API 行程內直接執行查詢，省去 broker、結果後端與前端輪詢的往返
+
+    編碼在執行緒池中進行，Qdrant 透過 AsyncQdrantClient 呼叫，事件迴圈不會被阻塞。
+    提供 batcher 時，並行的查詢會交給 QueryBatcher 合併成批次編碼與批次搜尋。
+    """
+
+    def __init__(self, vectorizer, async_client, query_cache=None, collection_name=DEFAULT_COLLECTION,
+                 max_inflight=DIRECT_QUERY_MAX_INFLIGHT, pool_workers=EMBED_POOL_WORKERS, batcher=None,
+                 profile=None):
+        self.vectorizer = vectorizer
+        self.batcher = batcher
+        self.client = async_client
+        self.query_cache = query_cache
+        self.profile = get_profile(profile)
+        # 各集合是否有 BM25 稀疏向量：{集合: (讀取時的集合版本, 是否有稀疏向量)}
+        self._hybrid = {}
+        self.collection_name = collection_name
+        self.max_inflight = max_inflight
+        self._executor = ThreadPoolExecutor(max_workers=pool_workers, thread_name_prefix="embed")
+        self._inflight = 0
+
+    def saturated(self):
+        # 只在事件迴圈執行緒中讀寫，不需要加鎖
+        return self._inflight >= self.max_inflight
+
+    def _encode(self, query_text):
+        if self.query_cache is not None:
+            vector = self.query_cache.get_embedding(query_text)
+            if vector is not None:
+                return vector
+        with stage_timer("encode_query"):
+            vector = self.vectorizer.encode(query_text, show_progress_bar=False).tolist()
+        if self.query_cache is not None:
+            self.query_cache.put_embedding(query_text, vector)
+        return vector
+
+    async def query(self, query_text, limit=5, hnsw_ef=None, exact=None, collection_name=None, filters=None):
+        """collection_name 為租戶的集合 (預設為建構時指定的集合)，filters 為 payload 篩選"""
+        loop = asyncio.get_running_loop()
+        collection_name = collection_name or self.collection_name
+        query_filter = build_filter(filters)
+        scope = filter_key(filters)
+        self._inflight += 1
+        # 覆寫查詢參數時不合併批次、也不使用查詢結果快取
+        overridden = hnsw_ef is not None or exact is not None
+        try:
+            if self.batcher is not None and not overridden:
+                return await asyncio.wrap_future(self.batcher.submit(query_text, limit, collection_name, filters))
+            query_vector = await loop.run_in_executor(self._executor, self._encode, query_text)
+            version = None
+            if self.query_cache is not None and not overridden:
+                cached, version = await loop.run_in_executor(
+                    self._executor, self.query_cache.get_results,
+                    collection_name, query_vector, limit, scope
+                )
+                if cached is not None:
+                    return cached
+            if not await self.client.collection_exists(collection_name):
+                logger.error("集合 %s 不存在", collection_name)
+                raise ValueError(f"集合 {collection_name} 不存在")
+            sparse_vector = bm25.encode_query(query_text) if await self._is_hybrid(collection_name, version) else None
+            with stage_timer("qdrant_search"):
+                # 稠密與 BM25 搜尋以單次 search_batch 送出，由 Qdrant 同時執行
+                search_result = await self.client.search_batch(
+                    collection_name=collection_name,
+                    requests=build_search_requests(
+                        query_vector, sparse_vector, limit, search_params(self.profile, hnsw_ef, exact), query_filter,
+                        CHUNK_QUERY_OVERSAMPLING if CHUNKING_ENABLED else 1
+                    )
+                )
+            results = merge_search_results(search_result, limit)
+            if version is not None:
+                await loop.run_in_executor(
+                    self._executor, self.query_cache.put_results,
+                    collection_name, query_vector, limit, version, results, scope
+                )
+            logger.debug("直接查詢返回 %d 條結果", len(results))
+            return results
+        finally:
+            self._inflight -= 1
+
+    async def _is_hybrid(self, collection_name, version=None):
+        """集合版本 (上傳或遷移時遞增) 改變後重新讀取集合設定"""
+        if version is None and self.query_cache is not None:
+            version = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.query_cache.current_version, collection_name
+            )
+        cached = self._hybrid.get(collection_name)
+        if cached is None or cached[0] != version:
+            cached = (version, hybrid_enabled(await self.client.get_collection(collection_name)))
+            self._hybrid[collection_name] = cached
+        return cached[1]
+
+    def warmup(self):
+        self.vectorizer.encode(["warmup"], show_progress_bar=False)
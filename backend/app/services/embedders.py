@@ -0,0 +1,182 @@
+from sentence_transformers import SentenceTransformer
+import numpy as np
+import tempfile
+import shutil
+import torch
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# torch：原始 float32 PyTorch；torch-int8：Linear 層動態 int8 量化；onnx / onnx-int8：ONNX Runtime
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+# 推論使用的執行緒數，0 表示沿用函式庫預設 (通常等於 CPU 核心數)
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))
+# 超過此 token 數的內容會被截斷，0 表示沿用模型設定
+EMBED_MAX_SEQ_LENGTH = int(os.getenv("EMBED_MAX_SEQ_LENGTH", "0"))
+# 匯出的 ONNX 模型存放目錄 (預設為 backend/data/models，與工作目錄無關)，第一次使用時自動從參考模型匯出
+EMBED_ONNX_DIR = os.getenv(
+    "EMBED_ONNX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data", "models")
+)
+
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+
+class TorchEmbedder:
+    """SentenceTransformer 包裝；可選擇對 Linear 層做動態 int8 量化
+
+    SentenceTransformer.encode 本身會依長度排序後再分批，每批只補齊到批內最長的內容。
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, quantize=False, threads=EMBED_THREADS,
+                 max_seq_length=EMBED_MAX_SEQ_LENGTH):
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model_name, device="cpu")
+        if max_seq_length:
+            self.model.max_seq_length = max_seq_length
+        if quantize:
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        # 切塊時使用與模型相同的 tokenizer 與長度上限
+        self.tokenizer = self.model.tokenizer
+        self.max_seq_length = self.model.max_seq_length
+        # fp32 沿用原本的模型名稱，既有的嵌入快取仍然有效
+        self.name = _embedder_name(model_name, "int8" if quantize else None, max_seq_length)
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, **kwargs):
+        return self.model.encode(
+            sentences, batch_size=batch_size, show_progress_bar=show_progress_bar,
+            convert_to_numpy=convert_to_numpy, **kwargs
+        )
+
+
+class OnnxEmbedder:
+    """以 ONNX Runtime 執行匯出的 Transformer，平均池化與正規化在 numpy 中完成"""
+
+    def __init__(self, model_dir, name, threads=EMBED_THREADS, max_seq_length=EMBED_MAX_SEQ_LENGTH):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("EMBED_BACKEND=onnx 需要安裝 onnxruntime")
+        from transformers import AutoTokenizer
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {node.name for node in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = max_seq_length or self.tokenizer.model_max_length
+        self.dimension = self.session.get_outputs()[0].shape[-1]
+        self.name = name
+
+    def _run(self, features):
+        inputs = {key: value.astype(np.int64) for key, value in features.items() if key in self.input_names}
+        hidden = self.session.run(None, inputs)[0]
+        mask = features["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        output = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        if texts:
+            encoded = self.tokenizer(texts, truncation=True, max_length=self.max_seq_length)
+            # 依 token 數排序後分批，每批只補齊到批內最長的內容，短內容不會被補到長內容的長度
+            order = sorted(range(len(texts)), key=lambda i: len(encoded["input_ids"][i]))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                features = self.tokenizer.pad(
+                    {key: [encoded[key][i] for i in batch] for key in encoded.keys()},
+                    return_tensors="np"
+                )
+                output[batch] = self._run(features)
+        return output[0] if single else output
+
+
+class _SentenceEmbeddingModule(torch.nn.Module):
+    # 匯出時只保留 Transformer 的 last_hidden_state，池化在推論端完成
+    def __init__(self, transformer):
+        super().__init__()
+        self.transformer = transformer
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.transformer(
+            input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+        )[0]
+
+
+def _embedder_name(model_name, variant=None, max_seq_length=0):
+    """嵌入快取與匯出目錄使用的名稱；截斷長度不同的向量不能共用快取"""
+    name = f"{model_name}+{variant}" if variant else model_name
+    return f"{name}+seq{max_seq_length}" if max_seq_length else name
+
+
+def export_onnx(model_name, model_dir, quantize=True, max_seq_length=0):
+    """從參考 SentenceTransformer 匯出 ONNX 模型與 tokenizer，可選擇動態 int8 量化
+
+    先寫到暫存目錄再改名，多個 worker 行程同時匯出時不會讀到寫到一半的檔案。
+    """
+    logger.info("匯出 ONNX 模型 %s 至 %s (int8=%s)", model_name, model_dir, quantize)
+    reference = SentenceTransformer(model_name, device="cpu")
+    parent = os.path.dirname(os.path.abspath(model_dir))
+    os.makedirs(parent, exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=parent, prefix=".export-")
+    try:
+        sample = reference.tokenizer(["warmup"], return_tensors="pt")
+        fp32_path = os.path.join(work_dir, "model.fp32.onnx")
+        input_names = ["input_ids", "attention_mask", "token_type_ids"]
+        torch.onnx.export(
+            _SentenceEmbeddingModule(reference[0].auto_model).eval(),
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]},
+            opset_version=14,
+        )
+        model_path = os.path.join(work_dir, "model.onnx")
+        if quantize:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+            os.remove(fp32_path)
+        else:
+            os.replace(fp32_path, model_path)
+        # 沿用指定或參考模型的截斷長度 (MiniLM 為 256，而非 tokenizer 預設的 512)
+        reference.tokenizer.model_max_length = max_seq_length or reference.max_seq_length
+        reference.tokenizer.save_pretrained(work_dir)
+        try:
+            os.replace(work_dir, model_dir)
+        except OSError:
+            # 其他行程已先完成匯出
+            if not os.path.exists(os.path.join(model_dir, "model.onnx")):
+                raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return model_dir
+
+
+def create_embedder(backend=EMBED_BACKEND, model_name=EMBEDDING_MODEL_NAME, threads=EMBED_THREADS,
+                    max_seq_length=EMBED_MAX_SEQ_LENGTH, onnx_dir=EMBED_ONNX_DIR):
+    """依設定建立嵌入後端；所有後端都提供與 SentenceTransformer 相容的 encode()"""
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的嵌入後端: {backend}，可用: {', '.join(BACKENDS)}")
+    if backend.startswith("torch"):
+        return TorchEmbedder(model_name, quantize=backend == "torch-int8", threads=threads,
+                             max_seq_length=max_seq_length)
+    quantize = backend == "onnx-int8"
+    variant = "onnx-int8" if quantize else "onnx"
+    name = _embedder_name(model_name, variant, max_seq_length)
+    model_dir = os.path.join(onnx_dir, name.replace("/", "__").replace("+", "-"))
+    if not os.path.exists(os.path.join(model_dir, "model.onnx")):
+        export_onnx(model_name, model_dir, quantize=quantize, max_seq_length=max_seq_length)
+    return OnnxEmbedder(model_dir, name, threads=threads, max_seq_length=max_seq_length)
@@ -0,0 +1,94 @@
+import numpy as np
+import sqlite3
+import threading
+import time
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+EMBED_CACHE_PATH = os.getenv(
+    "EMBED_CACHE_PATH",
+    os.path.join(os.getcwd(), "data", "cache", f"embeddings-{os.getenv('PORT', 'local')}.sqlite")
+)
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "1000000"))
+
+# SQLite 單一查詢允許的參數數量有限，分段查詢
+_SQL_CHUNK = 500
+
+
+class EmbeddingCache:
+    """以內容雜湊為鍵、存放在本機 SQLite 的嵌入向量快取，超過上限時依最近使用時間淘汰"""
+
+    def __init__(self, path=EMBED_CACHE_PATH, model_name="", max_entries=EMBED_CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    def _key(self, content_hash):
+        # 模型不同時向量不可共用
+        return f"{self.model_name}:{content_hash}"
+
+    def get_many(self, content_hashes):
+        """回傳 {content_hash: np.ndarray}，只包含命中的項目"""
+        keys = {self._key(h): h for h in content_hashes}
+        found = {}
+        now = int(time.time())
+        with self._lock:
+            key_list = list(keys)
+            for i in range(0, len(key_list), _SQL_CHUNK):
+                chunk = key_list[i:i + _SQL_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[keys[key]] = np.frombuffer(blob, dtype=np.float32)
+                if rows:
+                    hit_keys = [key for key, _ in rows]
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(hit_keys))})",
+                        [now, *hit_keys]
+                    )
+            self._conn.commit()
+        return found
+
+    def put_many(self, content_hashes, vectors):
+        now = int(time.time())
+        rows = [
+            (self._key(h), np.asarray(v, dtype=np.float32).tobytes(), now)
+            for h, v in zip(content_hashes, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            logger.debug("嵌入快取淘汰 %d 筆", excess)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,103 @@
+import struct
+import json
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", os.path.join(os.getcwd(), "data", "journal"))
+
+# 索引檔每個批次一筆固定長度紀錄：(批次第一列在本次上傳中的列位移, 批次列數)
+_INDEX_ENTRY = struct.Struct("<QI")
+
+
+class IngestionJournal:
+    """單次上傳 (或單一分片) 專用的追加式日誌
+
+    - {upload_id}.idx：每個批次一筆固定長度的列位移紀錄，串流時逐批追加
+    - {upload_id}.commit：已成功寫入 Qdrant 的批次數，用來從中斷處續傳
+    記錄本身可由暫存的 CSV 依列位移重新讀出，因此只記錄位移；續傳時只讀取最後一筆已提交的索引紀錄。
+    """
+
+    def __init__(self, upload_id, journal_dir=JOURNAL_DIR):
+        if not upload_id or os.path.basename(upload_id) != upload_id:
+            raise ValueError(f"無效的上傳 ID: {upload_id}")
+        self.upload_id = upload_id
+        self.journal_dir = journal_dir
+        self.index_path = os.path.join(journal_dir, f"{upload_id}.idx")
+        self.commit_path = os.path.join(journal_dir, f"{upload_id}.commit")
+        os.makedirs(journal_dir, exist_ok=True)
+
+        self.committed_batches = self._read_commit()
+        self.committed_rows = self._committed_end()
+        self._truncate_uncommitted()
+        self._index_file = open(self.index_path, "ab")
+        self._next_batch = self.committed_batches
+        self._next_row = self.committed_rows
+        self._pending = {}
+
+    def _read_commit(self):
+        try:
+            with open(self.commit_path, "r", encoding="utf-8") as f:
+                return json.load(f)["batches"]
+        except FileNotFoundError:
+            return 0
+
+    def _read_entry(self, batch_no):
+        with open(self.index_path, "rb") as f:
+            f.seek(batch_no * _INDEX_ENTRY.size)
+            return _INDEX_ENTRY.unpack(f.read(_INDEX_ENTRY.size))
+
+    def _committed_end(self):
+        """最後一個已提交批次的結束列位移，即續傳的起點"""
+        if not self.committed_batches:
+            return 0
+        start, rows = self._read_entry(self.committed_batches - 1)
+        return start + rows
+
+    def _truncate_uncommitted(self):
+        """丟棄上次中斷時已寫入但尚未提交的批次"""
+        size = self.committed_batches * _INDEX_ENTRY.size
+        if os.path.exists(self.index_path) and os.path.getsize(self.index_path) > size:
+            with open(self.index_path, "r+b") as f:
+                f.truncate(size)
+            logger.debug("日誌 %s 截斷至 %d bytes", self.index_path, size)
+
+    def append_batch(self, records):
+        """追加一個批次的索引紀錄並回傳批次編號；此時尚未提交"""
+        batch_no = self._next_batch
+        self._index_file.write(_INDEX_ENTRY.pack(self._next_row, len(records)))
+        self._index_file.flush()
+        self._pending[batch_no] = self._next_row + len(records)
+        self._next_row += len(records)
+        self._next_batch += 1
+        return batch_no
+
+    def commit(self, batch_no):
+        """標記 batch_no (含) 之前的批次已寫入 Qdrant；以 os.replace 原子更新"""
+        self.committed_batches = batch_no + 1
+        self.committed_rows = self._pending.pop(batch_no)
+        tmp_path = self.commit_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"batches": self.committed_batches}, f)
+        os.replace(tmp_path, self.commit_path)
+
+    def close(self):
+        self._index_file.close()
+
+    def remove(self):
+        """上傳成功後刪除日誌"""
+        remove_journal(self.upload_id, self.journal_dir)
+
+
+def remove_journal(upload_id, journal_dir=JOURNAL_DIR):
+    for suffix in (".idx", ".commit", ".commit.tmp"):
+        path = os.path.join(journal_dir, f"{upload_id}{suffix}")
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("刪除日誌 %s 失敗: %s", path, str(e))
@@ -0,0 +1,73 @@
+import time
+import json
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+NODE_STATS_KEY = "node_stats" # 所有節點狀態存在同一個雜湊中，欄位為節點名稱
+NODE_EXPIRY_SECONDS = 10 # 超過此秒數未更新的節點視為離線 (例如 10 秒)
+
+# 延遲敏感的查詢與批次上傳使用不同佇列，由不同設定的 worker 消費
+QUERY_QUEUE = "queries"
+INGEST_QUEUE = "ingest"
+# 每個節點的 ingest worker 也會消費 ingest.<節點名稱>，讓路由器能指定節點
+NODE_INGEST_QUEUE_PREFIX = "ingest."
+
+# 超過任一門檻的節點不會被指派新的上傳
+INGEST_MAX_CPU_PERCENT = float(os.getenv("INGEST_MAX_CPU_PERCENT", "85"))
+INGEST_MAX_MEMORY_PERCENT = float(os.getenv("INGEST_MAX_MEMORY_PERCENT", "90"))
+# 節點佇列中每多一個等待中的上傳，相當於增加多少 CPU 使用率
+INGEST_BACKLOG_WEIGHT = float(os.getenv("INGEST_BACKLOG_WEIGHT", "25"))
+
+
+def parse_node_stats(raw, now=None):
+    """解析 node_stats 雜湊；超過 NODE_EXPIRY_SECONDS 未更新的節點視為離線"""
+    now = now or time.time()
+    nodes, stale = [], []
+    for node_name, node_data_json in raw.items():
+        try:
+            node_data = json.loads(node_data_json)
+        except json.JSONDecodeError:
+            logger.error(f"無法解析 Redis 中的節點數據: {node_name}")
+            continue
+        if now - node_data.get("updated_at", 0) > NODE_EXPIRY_SECONDS:
+            stale.append(node_name)
+            continue
+        nodes.append(node_data)
+    return sorted(nodes, key=lambda node: node["node"]), stale
+
+
+def pick_ingest_queue(nodes, backlogs):
+    """依節點即時負載挑選上傳佇列
+
+    nodes 為 parse_node_stats 的結果，backlogs 為 {節點名稱: 節點佇列長度}。
+    所有節點都已飽和或沒有節點資料時，退回共用的 ingest 佇列，由先空閒的 worker 取走。
+    """
+    candidates = [
+        node for node in nodes
+        if node["cpu_percent"] < INGEST_MAX_CPU_PERCENT
+        and node["memory_percent"] < INGEST_MAX_MEMORY_PERCENT
+    ]
+    if not candidates:
+        logger.debug("沒有未飽和的節點，上傳任務送往共用佇列")
+        return INGEST_QUEUE
+    best = min(
+        candidates,
+        key=lambda node: node["cpu_percent"] + INGEST_BACKLOG_WEIGHT * backlogs.get(node["node"], 0)
+    )
+    return f"{NODE_INGEST_QUEUE_PREFIX}{best['node']}"
+
+
+async def choose_ingest_queue(redis):
+    """以一次 pipeline 讀取節點狀態與各節點佇列長度 (asyncio Redis)"""
+    nodes, _ = parse_node_stats(await redis.hgetall(NODE_STATS_KEY))
+    if not nodes:
+        return INGEST_QUEUE
+    pipe = redis.pipeline()
+    for node in nodes:
+        pipe.llen(f"{NODE_INGEST_QUEUE_PREFIX}{node['node']}")
+    backlogs = {node["node"]: depth for node, depth in zip(nodes, await pipe.execute())}
+    return pick_ingest_queue(nodes, backlogs)
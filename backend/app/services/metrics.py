@@ -0,0 +1,98 @@
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily
+from contextlib import contextmanager
+from .load_router import NODE_INGEST_QUEUE_PREFIX, QUERY_QUEUE, INGEST_QUEUE
+import time
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+NODE_NAME = f"node{os.getenv('PORT', 'unknown')[-1]}"
+# 同一容器內的 uvicorn 與 celery 行程共用此目錄，/metrics 會彙整成單一節點的數據
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# 計算佇列深度時檢查的共用 Celery 佇列 (Redis broker 中為同名 list)
+CELERY_QUEUES = [q for q in os.getenv("CELERY_QUEUES", f"{QUERY_QUEUE},{INGEST_QUEUE}").split(",") if q]
+
+# 涵蓋從亞毫秒的快取查找到數十秒的批次上傳
+_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+            1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "各處理階段耗時", ["node", "stage"], buckets=_BUCKETS
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "rag_http_request_seconds", "API 請求耗時", ["node", "method", "route", "status"], buckets=_BUCKETS
+)
+CACHE_REQUESTS = Counter(
+    "rag_cache_requests_total", "快取查找次數", ["node", "cache", "result"]
+)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(NODE_NAME, stage).observe(seconds)
+
+
+@contextmanager
+def stage_timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(NODE_NAME, stage).observe(time.perf_counter() - start)
+
+
+def count_cache(cache, hits=0, misses=0):
+    if hits:
+        CACHE_REQUESTS.labels(NODE_NAME, cache, "hit").inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(NODE_NAME, cache, "miss").inc(misses)
+
+
+# 共用佇列的深度是整個叢集的數值，以此標籤取代節點名稱
+CLUSTER_LABEL = "cluster"
+
+
+class QueueDepthCollector:
+    """抓取時才以 LLEN 讀取 broker 佇列長度，不需要額外的背景執行緒
+
+    共用佇列以 node="cluster" 回報；每個節點都會回報相同的數值，彙總時應取 max 而非 sum。
+    各節點只回報自己的 ingest.<節點名稱> 佇列，以節點名稱為標籤。
+    """
+
+    def __init__(self, redis_client, queues=None):
+        self.redis = redis_client
+        self.queues = queues or CELERY_QUEUES
+
+    def collect(self):
+        gauge = GaugeMetricFamily("rag_queue_depth", "Celery 佇列中等待的任務數", labels=["node", "queue"])
+        try:
+            queues = [(CLUSTER_LABEL, queue_name) for queue_name in self.queues]
+            queues.append((NODE_NAME, f"{NODE_INGEST_QUEUE_PREFIX}{NODE_NAME}"))
+            pipe = self.redis.pipeline()
+            for _, queue_name in queues:
+                pipe.llen(queue_name)
+            for (label, queue_name), depth in zip(queues, pipe.execute()):
+                gauge.add_metric([label, queue_name], depth)
+        except Exception as e:
+            logger.warning("讀取佇列深度失敗: %s", str(e))
+        yield gauge
+
+
+def render_metrics(redis_client=None):
+    """回傳 (內容, Content-Type)；多行程模式下彙整同一節點所有行程的數據"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    output = generate_latest(registry)
+    if redis_client is not None:
+        queue_registry = CollectorRegistry()
+        queue_registry.register(QueueDepthCollector(redis_client))
+        output += generate_latest(queue_registry)
+    return output, CONTENT_TYPE_LATEST
@@ -1,8 +1,17 @@
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams, PointStruct
+from qdrant_client.http.models import SearchRequest, NamedSparseVector
 from sentence_transformers import SentenceTransformer
+from itertools import islice
+from .metrics import stage_timer, count_cache
+from .collection_profiles import get_profile, collection_config, search_params
+from .tenants import DEFAULT_COLLECTION, build_filter, filter_key, ensure_payload_indexes
+from . import bm25
+import numpy as np
+import queue
+import threading
+import hashlib
+import unicodedata
 import uuid
-import json
 import os
 import logging
 
@@ -10,19 +19,127 @@ import logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# 每批編碼與上傳的筆數，以及編碼與上傳之間允許堆積的批次數
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+UPLOAD_QUEUE_DEPTH = int(os.getenv("UPLOAD_QUEUE_DEPTH", "2"))
+# 啟用切塊時查詢多取的候選倍數，同一列的多個區塊合併後仍能湊滿 limit 筆結果
+CHUNK_QUERY_OVERSAMPLING = int(os.getenv("CHUNK_QUERY_OVERSAMPLING", "3"))
+
+
+# 由內容雜湊衍生 point ID 時使用的命名空間，變更會讓所有 ID 失效
+POINT_ID_NAMESPACE = uuid.UUID("5b0f3c1e-8c1d-4d7a-9a51-6f1f0c2b7e42")
+
+
+def normalize_content(content):
+    """正規化內容：Unicode NFKC、合併連續空白、去除首尾空白"""
+    return " ".join(unicodedata.normalize("NFKC", content).split())
+
+
+def content_hash(content):
+    return hashlib.sha256(normalize_content(content).encode("utf-8")).hexdigest()
+
+
+def point_id(chash, source):
+    """相同內容與來源永遠得到相同 ID，重複上傳只會覆寫而不會新增"""
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{chash}\x1f{source}"))
+
+
+def chunk_point_id(parent_id, chunk_index):
+    """區塊 ID 由父列 ID 與區塊序號決定，重複上傳同一列時會得到相同的區塊 ID"""
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{parent_id}\x1f{chunk_index}"))
+
+
+def format_hits(hits, scores=None):
+    """將 Qdrant 的搜尋結果轉為 API 回傳格式；scores 用於取代原始分數 (例如 RRF 分數)"""
+    return [
+        {
+            "id": hit.id,
+            "content": hit.payload["content"],
+            "source": hit.payload["source"],
+            "score": hit.score if scores is None else scores[i]
+        }
+        for i, hit in enumerate(hits)
+    ]
+
+
+def build_search_requests(query_vector, sparse_vector, limit, params, query_filter=None, oversampling=1):
+    """稠密搜尋一律執行；有 BM25 查詢向量時加入稀疏搜尋，兩者在同一次 search_batch 中執行
+
+    oversampling 只在集合含有區塊時大於 1，未切塊時每個 point 就是一列，不必多取。
+    """
+    candidates = limit * oversampling
+    if sparse_vector is None:
+        return [SearchRequest(
+            vector=query_vector, filter=query_filter, limit=candidates, params=params, with_payload=True
+        )]
+    candidates = max(candidates, bm25.HYBRID_CANDIDATES)
+    return [
+        SearchRequest(vector=query_vector, filter=query_filter, limit=candidates, params=params, with_payload=True),
+        SearchRequest(
+            vector=NamedSparseVector(name=bm25.SPARSE_VECTOR_NAME, vector=sparse_vector),
+            filter=query_filter,
+            limit=candidates,
+            with_payload=True
+        ),
+    ]
+
+
+def merge_search_results(result_lists, limit):
+    """混合檢索時以 RRF 融合兩份名次，再將同一列的區塊合併為一筆 (保留名次最高的區塊)"""
+    if len(result_lists) == 1:
+        ranked = [(hit, hit.score) for hit in result_lists[0]]
+    else:
+        ranked = bm25.reciprocal_rank_fusion(result_lists, None, weights=bm25.HYBRID_WEIGHTS)
+    kept, seen = [], set()
+    for hit, score in ranked:
+        parent = hit.payload.get("parent_id", str(hit.id))
+        if parent in seen:
+            continue
+        seen.add(parent)
+        kept.append((hit, score))
+        if len(kept) == limit:
+            break
+    return format_hits([hit for hit, _ in kept], [score for _, score in kept])
+
+
+def hybrid_enabled(collection_info):
+    """集合建立時是否帶有 BM25 稀疏向量；舊集合需以 collection_migration 重建"""
+    sparse = collection_info.config.params.sparse_vectors or {}
+    return bm25.HYBRID_SEARCH and bm25.SPARSE_VECTOR_NAME in sparse
+
+
+def _iter_batches(records, batch_size):
+    iterator = iter(records)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
 class QdrantService:
-    def __init__(self, host="qdrant", port=6333):
+    def __init__(self, host="qdrant", port=6333, client=None, vectorizer=None, embedding_cache=None,
+                 query_cache=None, profile=None, chunker=None, collection_name=DEFAULT_COLLECTION):
         logger.debug("初始化 QdrantService，連接到 %s:%d", host, port)
         try:
-            self.client = QdrantClient(host=host, port=port)
+            # 可由 service_registry 注入共用的客戶端與模型，避免每個任務重新建立
+            self.client = client if client is not None else QdrantClient(host=host, port=port)
             logger.debug("Qdrant 客戶端初始化成功")
         except Exception as e:
             logger.exception("Qdrant 客戶端初始化失敗: %s", str(e))
             raise
-        self.collection_name = "KnowledgeBase"
-        self.vectorizer = SentenceTransformer('all-MiniLM-L6-v2')
+        # 每個租戶一個集合，由 service_registry 依集合名稱建立各自的 QdrantService
+        self.collection_name = collection_name
+        self.vectorizer = vectorizer if vectorizer is not None else SentenceTransformer('all-MiniLM-L6-v2')
         self.vector_dim = 384
-        self.json_file_path = os.path.join(os.getcwd(), "data", "data.json")
+        self.embedding_cache = embedding_cache
+        self.query_cache = query_cache
+        # 量化、磁碟存放與 HNSW 參數；見 collection_profiles
+        self.profile = get_profile(profile)
+        # 集合是否有 BM25 稀疏向量，第一次需要時才向 Qdrant 查詢；集合版本變更後重新查詢
+        self._hybrid = None
+        self._hybrid_version = None
+        # 將過長的內容切成重疊的區塊後再編碼；見 chunking.Chunker
+        self.chunker = chunker
 
     def create_collection(self):
         logger.debug("檢查並創建集合: %s", self.collection_name)
@@ -30,95 +147,306 @@ class QdrantService:
             if not self.client.collection_exists(self.collection_name):
                 self.client.create_collection(
                     collection_name=self.collection_name,
-                    vectors_config=VectorParams(size=self.vector_dim, distance=Distance.COSINE)
+                    **collection_config(self.profile, self.vector_dim)
                 )
-                logger.debug("集合 %s 創建成功", self.collection_name)
+                self._hybrid = bm25.HYBRID_SEARCH
+                logger.debug("集合 %s 以設定檔 %s 創建成功", self.collection_name, self.profile["name"])
             else:
                 logger.debug("集合 %s 已存在", self.collection_name)
+                self.hybrid()
+            # 建立索引是冪等的，既有集合也會補上新增的篩選欄位索引
+            ensure_payload_indexes(self.client, self.collection_name)
         except Exception as e:
             logger.exception("創建集合失敗: %s", str(e))
             raise
 
-    def store_data(self, data_list):
-        logger.debug("開始儲存 %d 條數據", len(data_list))
-        
+    def oversampling(self):
+        return CHUNK_QUERY_OVERSAMPLING if self.chunker is not None else 1
+
+    def hybrid(self, version=None):
+        """集合是否有 BM25 稀疏向量；上傳或遷移遞增集合版本後重新讀取集合設定
+
+        version 為呼叫端已讀到的集合版本 (例如查詢快取一併讀取的版本)，未提供時另外讀取。
+        """
+        if version is None and self.query_cache is not None:
+            version = self.query_cache.current_version(self.collection_name)
+        if self._hybrid is None or version != self._hybrid_version:
+            self._hybrid = hybrid_enabled(self.client.get_collection(self.collection_name))
+            self._hybrid_version = version
+            if bm25.HYBRID_SEARCH and not self._hybrid:
+                logger.warning("集合 %s 沒有 BM25 稀疏向量，僅使用向量搜尋", self.collection_name)
+        return self._hybrid
+
+    def store_data(self, data_list, batch_size=None, journal=None, on_commit=None):
+        """儲存數據；data_list 可為 list 或任意可迭代物件 (例如串流解析的 CSV)
+
+        若提供 journal，會跳過日誌中已提交的列，從上次中斷的批次繼續。
+        on_commit(rows) 會在每個批次寫入 Qdrant 後被呼叫，用於回報進度。
+        """
         # 確保集合存在
         self.create_collection()
-        
-        # 儲存數據到 JSON 檔案
-        try:
-            os.makedirs(os.path.dirname(self.json_file_path), exist_ok=True)
-            with open(self.json_file_path, 'w', encoding='utf-8') as f:
-                json.dump(data_list, f, ensure_ascii=False, indent=4)
-            logger.debug("數據已儲存到 %s", self.json_file_path)
-        except Exception as e:
-            logger.exception("儲存 JSON 檔案失敗: %s", str(e))
-            raise
 
-        # 從 JSON 檔案載入數據
+        records = iter(data_list)
+        if journal is not None and journal.committed_rows:
+            logger.info("從第 %d 列續傳上傳 %s", journal.committed_rows, journal.upload_id)
+            records = islice(records, journal.committed_rows, None)
+        return self._embed_and_upload(records, batch_size or EMBED_BATCH_SIZE, journal, on_commit)
+
+    def _embed_and_upload(self, records, batch_size, journal=None, on_commit=None):
+        """生產者/消費者管線：主執行緒編碼第 N+1 批時，背景執行緒上傳第 N 批
+
+        回傳統計：new (新增)、updated (同 ID 但原始內容不同)、unchanged (略過)、
+        cache_hits (命中嵌入快取而不必編碼的列)。
+        """
+        upload_queue = queue.Queue(maxsize=UPLOAD_QUEUE_DEPTH)
+        stop_event = threading.Event()
+        errors = []
+
+        def uploader():
+            while True:
+                item = upload_queue.get()
+                if item is None:
+                    return
+                if stop_event.is_set():
+                    continue
+                batch_no, rows, ids, vectors, payloads = item
+                try:
+                    if ids:
+                        logger.debug("上傳批次，數量: %d", len(ids))
+                        # 使用欄式批次上傳 API，直接送出整個向量矩陣
+                        with stage_timer("qdrant_upsert"):
+                            self.client.upload_collection(
+                                collection_name=self.collection_name,
+                                vectors=vectors,
+                                payload=payloads,
+                                ids=ids,
+                                batch_size=len(ids),
+                                parallel=1,
+                                wait=True
+                            )
+                    if journal is not None:
+                        journal.commit(batch_no)
+                except Exception as e:
+                    logger.exception("上傳批次失敗: %s", str(e))
+                    errors.append(e)
+                    stop_event.set()
+                    continue
+                if on_commit is not None:
+                    try:
+                        on_commit(rows)
+                    except Exception as e:
+                        logger.warning("回報上傳進度失敗: %s", str(e))
+
+        upload_thread = threading.Thread(target=uploader, name="qdrant-uploader", daemon=True)
+        upload_thread.start()
+
+        stats = {"rows": 0, "new": 0, "updated": 0, "unchanged": 0, "cache_hits": 0}
         try:
-            with open(self.json_file_path, 'r', encoding='utf-8') as f:
-                data_list = json.load(f)
-            logger.debug("從 JSON 檔案載入 %d 條數據", len(data_list))
+            for batch in _iter_batches(records, batch_size):
+                if stop_event.is_set():
+                    break
+                batch_no = journal.append_batch(batch) if journal is not None else None
+                ids, vectors, payloads = self._prepare_batch(batch, batch_size, stats)
+                upload_queue.put((batch_no, len(batch), ids, vectors, payloads))
+                stats["rows"] += len(batch)
         except Exception as e:
-            logger.exception("載入 JSON 檔案失敗: %s", str(e))
+            logger.exception("向量化批次失敗: %s", str(e))
+            stop_event.set()
             raise
-        
-        # 將數據轉為向量並儲存到 Qdrant
-        points = []
-        batch_size = 100
-        for i, data in enumerate(data_list):
-            try:
-                content = str(data["content"])
-                logger.debug("向量化數據 %d: %s", i, content[:50])
-                vector = self.vectorizer.encode(content, show_progress_bar=False).tolist()
-                
-                point = PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector=vector,
-                    payload={
-                        "content": content,
-                        "source": str(data.get("source", "csv_upload"))
-                    }
+        finally:
+            upload_queue.put(None)
+            upload_thread.join()
+
+        if errors:
+            raise errors[0]
+        logger.debug("所有數據儲存完成: %s", stats)
+        return stats
+
+    def _prepare_batch(self, batch, batch_size, stats):
+        """計算確定性 ID，略過已存在且內容相同的列，其餘優先從快取取得向量"""
+        rows = len(batch)
+        if self.chunker is not None:
+            # 在批次內切塊，日誌、進度與 new/updated/unchanged 統計仍以原始列計算
+            with stage_timer("chunk"):
+                batch = self.chunker.expand(batch)
+        pending = {}
+        for data in batch:
+            content = str(data["content"])
+            source = str(data.get("source", "csv_upload"))
+            chash = content_hash(content)
+            parent = {}
+            if "parent_id" in data:
+                parent = {"parent_id": data["parent_id"], "chunk_index": data["chunk_index"]}
+                pid = chunk_point_id(data["parent_id"], data["chunk_index"])
+            else:
+                pid = point_id(chash, source)
+            # 同一批次內重複的列只保留最後一筆
+            pending[pid] = (content, source, chash, parent)
+        # 區塊的 parent_id 即為原始列的 point ID，據此將區塊歸回所屬的列
+        row_status = {}
+
+        with stage_timer("qdrant_retrieve"):
+            existing = {
+                str(point.id): point.payload.get("content")
+                for point in self.client.retrieve(
+                    collection_name=self.collection_name,
+                    ids=list(pending),
+                    with_payload=["content"],
+                    with_vectors=False
                 )
-                points.append(point)
-                
-                if len(points) >= batch_size or i == len(data_list) - 1:
-                    logger.debug("上傳批次，數量: %d", len(points))
-                    self.client.upsert(
-                        collection_name=self.collection_name,
-                        points=points
-                    )
-                    points = []
-            except Exception as e:
-                logger.exception("處理數據 %d 失敗: %s", i, str(e))
-                raise
-        
-        logger.debug("所有數據儲存完成")
-
-    def query(self, query_text, limit=5):
+            }
+
+        ids, payloads, hashes = [], [], []
+        for pid, (content, source, chash, parent) in pending.items():
+            if pid in existing:
+                status = "unchanged" if existing[pid] == content else "updated"
+            else:
+                status = "new"
+            row_status.setdefault(parent.get("parent_id", pid), set()).add(status)
+            if status == "unchanged":
+                continue
+            ids.append(pid)
+            hashes.append(chash)
+            payloads.append({"content": content, "source": source, "content_hash": chash, **parent})
+        # 一列的所有區塊狀態相同時沿用該狀態，部分區塊有變動則視為更新
+        for statuses in row_status.values():
+            stats[statuses.pop() if len(statuses) == 1 else "updated"] += 1
+        # 批次內重複的列視為未變動
+        stats["unchanged"] += rows - len(row_status)
+
+        if not ids:
+            return [], None, []
+
+        cached = self.embedding_cache.get_many(set(hashes)) if self.embedding_cache is not None else {}
+        missing = [i for i, chash in enumerate(hashes) if chash not in cached]
+        vectors = np.empty((len(ids), self.vector_dim), dtype=np.float32)
+        for i, chash in enumerate(hashes):
+            if chash in cached:
+                vectors[i] = cached[chash]
+        stats["cache_hits"] += len(ids) - len(missing)
+        if self.embedding_cache is not None:
+            count_cache("embedding", hits=len(ids) - len(missing), misses=len(missing))
+
+        if missing:
+            with stage_timer("encode_ingest"):
+                encoded = self.vectorizer.encode(
+                    [payloads[i]["content"] for i in missing],
+                    batch_size=batch_size,
+                    show_progress_bar=False,
+                    convert_to_numpy=True
+                )
+            vectors[missing] = encoded
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many([hashes[i] for i in missing], encoded)
+        if self.hybrid():
+            # 稠密向量使用未命名的預設向量，BM25 詞頻權重另存為稀疏向量
+            with stage_timer("encode_bm25"):
+                vectors = [
+                    {"": vector.tolist(), bm25.SPARSE_VECTOR_NAME: bm25.encode_document(payload["content"])}
+                    for vector, payload in zip(vectors, payloads)
+                ]
+        return ids, vectors, payloads
+
+    def embed_query(self, query_text):
+        """將查詢轉為向量；有查詢快取時先查 L1"""
+        if self.query_cache is not None:
+            vector = self.query_cache.get_embedding(query_text)
+            if vector is not None:
+                return vector
+        with stage_timer("encode_query"):
+            vector = self.vectorizer.encode(query_text, show_progress_bar=False).tolist()
+        if self.query_cache is not None:
+            self.query_cache.put_embedding(query_text, vector)
+        return vector
+
+    def query(self, query_text, limit=5, hnsw_ef=None, exact=None, filters=None):
+        """hnsw_ef / exact 可覆寫設定檔的查詢參數 (覆寫時不使用查詢結果快取)；filters 為 payload 篩選"""
         logger.debug("執行查詢: %s", query_text)
         try:
+            query_filter = build_filter(filters)
+            scope = filter_key(filters)
+            query_vector = self.embed_query(query_text)
+            version = None
+            if self.query_cache is not None and hnsw_ef is None and exact is None:
+                cached, version = self.query_cache.get_results(self.collection_name, query_vector, limit, scope)
+                if cached is not None:
+                    logger.debug("查詢結果快取命中，返回 %d 條結果", len(cached))
+                    return cached
             if not self.client.collection_exists(self.collection_name):
                 logger.error("集合 %s 不存在", self.collection_name)
                 raise ValueError(f"集合 {self.collection_name} 不存在")
-            query_vector = self.vectorizer.encode(query_text, show_progress_bar=False).tolist()
-            search_result = self.client.search(
-                collection_name=self.collection_name,
-                query_vector=query_vector,
-                limit=limit,
-                with_payload=True
-            )
-            results = [
-                {
-                    "content": hit.payload["content"],
-                    "source": hit.payload["source"],
-                    "score": hit.score
-                }
-                for hit in search_result
-            ]
+            sparse_vector = bm25.encode_query(query_text) if self.hybrid(version) else None
+            with stage_timer("qdrant_search"):
+                search_result = self.client.search_batch(
+                    collection_name=self.collection_name,
+                    requests=build_search_requests(
+                        query_vector, sparse_vector, limit, search_params(self.profile, hnsw_ef, exact), query_filter,
+                        self.oversampling()
+                    )
+                )
+            results = merge_search_results(search_result, limit)
+            if version is not None:
+                self.query_cache.put_results(self.collection_name, query_vector, limit, version, results, scope)
             logger.debug("查詢返回 %d 條結果", len(results))
             return results
         except Exception as e:
             logger.exception("查詢失敗: %s", str(e))
-            raise
\ No newline at end of file
+            raise
+
+    def query_batch(self, query_texts, limits, filters=None):
+        """批次查詢：未命中快取的查詢以單次 encode 編碼，並以單次 search_batch 送往 Qdrant
+
+        同一批次內的查詢共用相同的 filters。
+        """
+        logger.debug("執行批次查詢，數量: %d", len(query_texts))
+        query_filter = build_filter(filters)
+        scope = filter_key(filters)
+        vectors = [None] * len(query_texts)
+        if self.query_cache is not None:
+            vectors = [self.query_cache.get_embedding(text) for text in query_texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            with stage_timer("encode_query_batch"):
+                encoded = self.vectorizer.encode(
+                    [query_texts[i] for i in missing], show_progress_bar=False
+                ).tolist()
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+                if self.query_cache is not None:
+                    self.query_cache.put_embedding(query_texts[i], vector)
+
+        results = [None] * len(query_texts)
+        version = None
+        if self.query_cache is not None:
+            results, version = self.query_cache.get_many_results(self.collection_name, vectors, limits, scope)
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+
+        if not self.client.collection_exists(self.collection_name):
+            logger.error("集合 %s 不存在", self.collection_name)
+            raise ValueError(f"集合 {self.collection_name} 不存在")
+        params = search_params(self.profile)
+        hybrid = self.hybrid(version)
+        requests, spans = [], []
+        for i in pending:
+            sparse_vector = bm25.encode_query(query_texts[i]) if hybrid else None
+            query_requests = build_search_requests(
+                vectors[i], sparse_vector, limits[i], params, query_filter, self.oversampling()
+            )
+            spans.append((len(requests), len(requests) + len(query_requests)))
+            requests.extend(query_requests)
+        with stage_timer("qdrant_search_batch"):
+            batch_result = self.client.search_batch(collection_name=self.collection_name, requests=requests)
+        for i, (start, end) in zip(pending, spans):
+            results[i] = merge_search_results(batch_result[start:end], limits[i])
+        if version is not None:
+            self.query_cache.put_many_results(
+                self.collection_name,
+                [vectors[i] for i in pending],
+                [limits[i] for i in pending],
+                version,
+                [results[i] for i in pending],
+                scope
+            )
+        return results
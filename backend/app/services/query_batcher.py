@@ -0,0 +1,94 @@
+from concurrent.futures import Future
+from .tenants import DEFAULT_COLLECTION, filter_key
+import queue
+import threading
+import time
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# 收集查詢的時間窗 (毫秒)；0 表示停用微批次
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "3"))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "64"))
+
+
+class QueryBatcher:
+    """查詢合併器：收集時間窗內到達的查詢，以一次 QdrantService.query_batch 處理後再分送結果
+
+    get_service(collection_name) 回傳該集合的 QdrantService；不同集合或篩選條件的查詢分組處理。
+    """
+
+    def __init__(self, get_service, window_ms=QUERY_BATCH_WINDOW_MS, max_batch_size=QUERY_BATCH_MAX_SIZE):
+        self.get_service = get_service
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                    self._thread.start()
+
+    def submit(self, query_text, limit=5, collection_name=DEFAULT_COLLECTION, filters=None):
+        """提交查詢並立即回傳 Future；async 呼叫端可用 asyncio.wrap_future 等待"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((query_text, limit, collection_name, filters, future))
+        return future
+
+    def query(self, query_text, limit=5, collection_name=DEFAULT_COLLECTION, filters=None):
+        return self.submit(query_text, limit, collection_name, filters).result()
+
+    def _run(self):
+        while True:
+            try:
+                self._collect_and_dispatch()
+            except Exception as e:
+                # 任何例外都不能讓合併器執行緒結束，否則之後的查詢會永遠等待
+                logger.exception("查詢合併器發生錯誤: %s", str(e))
+
+    def _collect_and_dispatch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        # 呼叫端中斷連線或逾時時 asyncio.wrap_future 會取消 Future；略過這些查詢，
+        # 其餘的 Future 標記為執行中後便無法再被取消，之後可安全設定結果
+        batch = [item for item in batch if item[4].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        groups = {}
+        for item in batch:
+            _, _, collection_name, filters, _ = item
+            groups.setdefault((collection_name, filter_key(filters)), []).append(item)
+        logger.debug("合併 %d 個查詢為 %d 個批次", len(batch), len(groups))
+        for (collection_name, _), items in groups.items():
+            try:
+                results = self.get_service(collection_name).query_batch(
+                    [query_text for query_text, _, _, _, _ in items],
+                    [limit for _, limit, _, _, _ in items],
+                    items[0][3]
+                )
+            except Exception as e:
+                logger.exception("批次查詢失敗: %s", str(e))
+                for *_, future in items:
+                    future.set_exception(e)
+                continue
+            for (*_, future), result in zip(items, results):
+                future.set_result(result)
@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from .qdrant_client import normalize_content
+from .metrics import count_cache, stage_timer
+import numpy as np
+import hashlib
+import threading
+import time
+import json
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "4096"))
+QUERY_RESULT_TTL_SECONDS = int(os.getenv("QUERY_RESULT_TTL_SECONDS", "300"))
+# 命中率計數先在行程內累加，每隔這麼多秒才寫回 Redis 一次
+CACHE_STATS_FLUSH_SECONDS = float(os.getenv("CACHE_STATS_FLUSH_SECONDS", "5"))
+
+COLLECTION_VERSION_PREFIX = "collection_version:"
+QUERY_RESULT_PREFIX = "query_result:"
+QUERY_CACHE_STATS_KEY = "query_cache_stats"
+
+
+class QueryCache:
+    """查詢路徑的兩層快取
+
+    - L1：正規化查詢文字 -> 查詢向量，存在行程記憶體中的 LRU
+    - L2：(集合版本, 查詢向量, limit) -> 查詢結果，存在 Redis 並設定 TTL
+    每次上傳完成會遞增集合版本，舊版本的 L2 項目會自動失效。
+    """
+
+    def __init__(self, redis_client, embed_cache_size=QUERY_EMBED_CACHE_SIZE,
+                 result_ttl=QUERY_RESULT_TTL_SECONDS):
+        self.redis = redis_client
+        self.embed_cache_size = embed_cache_size
+        self.result_ttl = result_ttl
+        self._embeddings = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"l1_hits": 0, "l1_misses": 0, "l2_hits": 0, "l2_misses": 0}
+        self._last_flush = time.monotonic()
+
+    def get_embedding(self, query_text):
+        key = normalize_content(query_text)
+        with self._lock:
+            vector = self._embeddings.get(key)
+            if vector is not None:
+                self._embeddings.move_to_end(key)
+                self._counters["l1_hits"] += 1
+            else:
+                self._counters["l1_misses"] += 1
+        count_cache("l1", hits=int(vector is not None), misses=int(vector is None))
+        return vector
+
+    def put_embedding(self, query_text, vector):
+        key = normalize_content(query_text)
+        with self._lock:
+            self._embeddings[key] = vector
+            self._embeddings.move_to_end(key)
+            while len(self._embeddings) > self.embed_cache_size:
+                self._embeddings.popitem(last=False)
+
+    @staticmethod
+    def _result_key(collection_name, vector, limit, scope=""):
+        # scope 為篩選條件的摘要，相同查詢在不同篩選下的結果分開存放
+        digest = hashlib.sha1(np.asarray(vector, dtype=np.float32).tobytes()).hexdigest()
+        return f"{QUERY_RESULT_PREFIX}{collection_name}:{scope}:{limit}:{digest}"
+
+    def get_results(self, collection_name, vector, limit, scope=""):
+        """一次往返同時讀取集合版本與快取結果，版本不符視為未命中"""
+        hits, version = self.get_many_results(collection_name, [vector], [limit], scope)
+        return hits[0], version
+
+    def get_many_results(self, collection_name, vectors, limits, scope=""):
+        """批次版本：所有查詢的快取項目與集合版本在同一個 pipeline 中讀取"""
+        try:
+            pipe = self.redis.pipeline()
+            pipe.get(f"{COLLECTION_VERSION_PREFIX}{collection_name}")
+            for vector, limit in zip(vectors, limits):
+                pipe.get(self._result_key(collection_name, vector, limit, scope))
+            with stage_timer("cache_lookup"):
+                version, *cached_entries = pipe.execute()
+        except Exception as e:
+            logger.warning("讀取查詢結果快取失敗: %s", str(e))
+            return [None] * len(vectors), None
+        version = int(version or 0)
+        hits = []
+        for cached in cached_entries:
+            hit = None
+            if cached:
+                entry = json.loads(cached)
+                if entry["version"] == version:
+                    hit = entry["results"]
+            hits.append(hit)
+            self._count("l2_hits" if hit is not None else "l2_misses")
+            count_cache("l2", hits=int(hit is not None), misses=int(hit is None))
+        return hits, version
+
+    def put_many_results(self, collection_name, vectors, limits, version, results_list, scope=""):
+        try:
+            pipe = self.redis.pipeline()
+            for vector, limit, results in zip(vectors, limits, results_list):
+                pipe.setex(
+                    self._result_key(collection_name, vector, limit, scope),
+                    self.result_ttl,
+                    json.dumps({"version": version, "results": results}, ensure_ascii=False)
+                )
+            pipe.execute()
+        except Exception as e:
+            logger.warning("寫入查詢結果快取失敗: %s", str(e))
+
+    def put_results(self, collection_name, vector, limit, version, results, scope=""):
+        self.put_many_results(collection_name, [vector], [limit], version, [results], scope)
+
+    def current_version(self, collection_name):
+        """目前的集合版本；讀取失敗時回傳 None"""
+        try:
+            return int(self.redis.get(f"{COLLECTION_VERSION_PREFIX}{collection_name}") or 0)
+        except Exception as e:
+            logger.warning("讀取集合版本失敗: %s", str(e))
+            return None
+
+    def bump_version(self, collection_name):
+        """集合內容變更後呼叫，讓所有舊的結果快取失效"""
+        version = self.redis.incr(f"{COLLECTION_VERSION_PREFIX}{collection_name}")
+        logger.debug("集合 %s 版本更新為 %d", collection_name, version)
+        return version
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+            due = time.monotonic() - self._last_flush >= CACHE_STATS_FLUSH_SECONDS
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self):
+        with self._lock:
+            counters = {k: v for k, v in self._counters.items() if v}
+            for name in self._counters:
+                self._counters[name] = 0
+            self._last_flush = time.monotonic()
+        if not counters:
+            return
+        try:
+            pipe = self.redis.pipeline()
+            for name, value in counters.items():
+                pipe.hincrby(QUERY_CACHE_STATS_KEY, name, value)
+            pipe.execute()
+        except Exception as e:
+            logger.warning("寫入快取統計失敗: %s", str(e))
+
+
+def summarize_cache_stats(raw):
+    """彙整所有節點寫回 QUERY_CACHE_STATS_KEY 的計數並計算命中率"""
+    raw = {k: int(v) for k, v in raw.items()}
+    stats = {}
+    for level in ("l1", "l2"):
+        hits = raw.get(f"{level}_hits", 0)
+        misses = raw.get(f"{level}_misses", 0)
+        total = hits + misses
+        stats[level] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 4) if total else None,
+        }
+    return stats
@@ -0,0 +1,48 @@
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Celery 結果後端的序列化格式；msgpack 比 JSON 小且解碼較快，切換時所有節點必須一致
+RESULT_SERIALIZER = os.getenv("RESULT_SERIALIZER", "json")
+RESULT_SERIALIZERS = ("json", "msgpack")
+# 任務結果在 Redis 中保留的秒數，過期後由 Redis 自動刪除
+RESULT_EXPIRES_SECONDS = int(os.getenv("RESULT_EXPIRES_SECONDS", str(24 * 3600)))
+# 任務結果中每筆命中保留的內容字數；完整內容以 point ID 透過 /api/query/contents 取回，0 表示不保留內容
+RESULT_CONTENT_CHARS = int(os.getenv("RESULT_CONTENT_CHARS", "200"))
+# 單次取回內容的 point ID 上限
+RESULT_FETCH_MAX_IDS = int(os.getenv("RESULT_FETCH_MAX_IDS", "100"))
+
+if RESULT_SERIALIZER not in RESULT_SERIALIZERS:
+    raise ValueError(f"未知的結果序列化格式: {RESULT_SERIALIZER}，可用: {', '.join(RESULT_SERIALIZERS)}")
+
+
+def compact_hits(hits, content_chars=RESULT_CONTENT_CHARS):
+    """存入結果後端前精簡查詢結果：保留 point ID、分數與來源，內容截斷至 content_chars 字"""
+    compact = []
+    for hit in hits:
+        # 升級前寫入查詢結果快取的項目沒有 id
+        item = {"id": hit.get("id"), "score": hit["score"], "source": hit["source"]}
+        if content_chars > 0:
+            content = hit["content"]
+            item["content"] = content[:content_chars]
+            if len(content) > content_chars:
+                item["truncated"] = True
+        compact.append(item)
+    return compact
+
+
+def fetch_contents(client, collection_name, point_ids):
+    """依 point ID 取回完整內容，依請求順序回傳；不存在的 ID 會被略過"""
+    points = client.retrieve(
+        collection_name=collection_name, ids=point_ids, with_payload=["content", "source"], with_vectors=False
+    )
+    by_id = {str(point.id): point for point in points}
+    contents = []
+    for point_id in point_ids:
+        point = by_id.get(str(point_id))
+        if point is not None:
+            contents.append({"id": point.id, "content": point.payload["content"], "source": point.payload["source"]})
+    return contents
@@ -0,0 +1,188 @@
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from .qdrant_client import QdrantService
+from .embedding_cache import EmbeddingCache
+from .query_cache import QueryCache
+from .direct_query import DirectQueryService
+from .query_batcher import QueryBatcher, QUERY_BATCH_WINDOW_MS
+from .embedders import create_embedder, EMBEDDING_MODEL_NAME, EMBED_BACKEND
+from .chunking import create_chunker
+from .tenants import DEFAULT_COLLECTION
+from .metrics import observe_stage
+import redis
+import threading
+import time
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+QDRANT_HOST = os.getenv("QDRANT_HOST", "qdrant")
+QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "1") == "1"
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "1") == "1"
+
+# 每個 worker 行程共用的物件；在 fork 之後由 worker_process_init 重新建立
+_lock = threading.RLock()
+_vectorizer = None
+_clients = {}
+_embedding_cache = None
+_redis_client = None
+_query_cache = None
+_services = {}
+_async_client = None
+_direct_query_service = None
+
+
+def get_vectorizer():
+    """取得行程內共用的嵌入後端 (由 EMBED_BACKEND 選擇)，第一次呼叫時才載入"""
+    global _vectorizer
+    if _vectorizer is None:
+        with _lock:
+            if _vectorizer is None:
+                start = time.perf_counter()
+                _vectorizer = create_embedder()
+                elapsed = time.perf_counter() - start
+                observe_stage("model_load", elapsed)
+                logger.info("嵌入模型 %s (%s) 載入完成，耗時 %.2f 秒", EMBEDDING_MODEL_NAME, EMBED_BACKEND, elapsed)
+    return _vectorizer
+
+
+def get_qdrant_client(host=QDRANT_HOST, port=QDRANT_PORT):
+    """依 (host, port) 取得共用的 QdrantClient，底層 HTTP 連線池會被重複使用"""
+    key = (host, port)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = QdrantClient(host=host, port=port)
+                _clients[key] = client
+                logger.debug("建立共用 Qdrant 客戶端 %s:%d", host, port)
+    return client
+
+
+def get_embedding_cache():
+    """取得行程內共用的嵌入快取；停用時回傳 None"""
+    global _embedding_cache
+    if _embedding_cache is None and EMBED_CACHE_ENABLED:
+        with _lock:
+            if _embedding_cache is None:
+                # 以後端名稱作為快取鍵的一部分，量化模型的向量不會與 float32 混用
+                _embedding_cache = EmbeddingCache(model_name=get_vectorizer().name)
+    return _embedding_cache
+
+
+def get_redis_client():
+    """取得行程內共用的 Redis 客戶端 (內建連線池)"""
+    global _redis_client
+    if _redis_client is None:
+        with _lock:
+            if _redis_client is None:
+                _redis_client = redis.Redis(host=REDIS_HOST, port=6379, db=0, decode_responses=True)
+    return _redis_client
+
+
+def get_query_cache():
+    """取得行程內共用的查詢快取；停用時回傳 None"""
+    global _query_cache
+    if _query_cache is None and QUERY_CACHE_ENABLED:
+        with _lock:
+            if _query_cache is None:
+                _query_cache = QueryCache(get_redis_client())
+    return _query_cache
+
+
+def get_qdrant_service(collection_name=DEFAULT_COLLECTION):
+    """取得行程內共用的 QdrantService；每個集合 (租戶) 一個實例，共用客戶端、模型與快取"""
+    service = _services.get(collection_name)
+    if service is None:
+        with _lock:
+            service = _services.get(collection_name)
+            if service is None:
+                service = QdrantService(
+                    host=QDRANT_HOST,
+                    port=QDRANT_PORT,
+                    client=get_qdrant_client(),
+                    vectorizer=get_vectorizer(),
+                    embedding_cache=get_embedding_cache(),
+                    query_cache=get_query_cache(),
+                    chunker=create_chunker(get_vectorizer()),
+                    collection_name=collection_name,
+                )
+                _services[collection_name] = service
+    return service
+
+
+def get_async_qdrant_client():
+    """API 行程使用的非同步 Qdrant 客戶端"""
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                _async_client = AsyncQdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+    return _async_client
+
+
+def get_direct_query_service():
+    """取得 API 行程內的直接查詢服務 (與 worker 共用同一套模型與快取邏輯)"""
+    global _direct_query_service
+    if _direct_query_service is None:
+        with _lock:
+            if _direct_query_service is None:
+                _direct_query_service = DirectQueryService(
+                    vectorizer=get_vectorizer(),
+                    async_client=get_async_qdrant_client(),
+                    query_cache=get_query_cache(),
+                    batcher=QueryBatcher(get_qdrant_service) if QUERY_BATCH_WINDOW_MS > 0 else None,
+                )
+    return _direct_query_service
+
+
+def configure(service=None, redis_client=None):
+    """替換行程內共用的物件；供基準測試或離線工具使用 in-process 的 Qdrant 與假 Redis"""
+    global _redis_client
+    with _lock:
+        if redis_client is not None:
+            _redis_client = redis_client
+        if service is not None:
+            _services[service.collection_name] = service
+
+
+def is_warm():
+    return bool(_services)
+
+
+def reset_connections():
+    """丟棄 fork 前繼承的連線與快取檔案控制代碼；模型權重可以安全地共用，因此保留"""
+    global _embedding_cache, _redis_client, _query_cache
+    with _lock:
+        if _query_cache is not None:
+            _query_cache.flush_stats()
+            _query_cache = None
+        if _redis_client is not None:
+            _redis_client.close()
+            _redis_client = None
+        if _embedding_cache is not None:
+            # SQLite 連線同樣不能跨 fork 共用
+            _embedding_cache.close()
+            _embedding_cache = None
+        for client in _clients.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+        _clients.clear()
+        _services.clear()
+
+
+def warmup():
+    """載入模型、建立連線並執行一次編碼，讓第一個任務不必承擔冷啟動成本"""
+    start = time.perf_counter()
+    service = get_qdrant_service()
+    service.vectorizer.encode(["warmup"], show_progress_bar=False)
+    elapsed = time.perf_counter() - start
+    logger.info("服務預熱完成，耗時 %.2f 秒", elapsed)
+    return elapsed
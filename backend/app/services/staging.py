@@ -0,0 +1,50 @@
+import os
+import uuid
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# 暫存區位於所有節點共用的 ./data volume，Celery 只傳遞檔名而非檔案內容
+STAGING_DIR = os.getenv("STAGING_DIR", os.path.join(os.getcwd(), "data", "staging"))
+
+
+def new_staged_name(suffix=".csv"):
+    return f"{uuid.uuid4().hex}{suffix}"
+
+
+def resolve(staged_name):
+    """將暫存檔名轉為絕對路徑，拒絕任何跳出暫存區的名稱 (路徑分隔符號、. 與 ..、符號連結)"""
+    if (not isinstance(staged_name, str) or staged_name in (".", "..")
+            or os.path.basename(staged_name) != staged_name or os.sep in staged_name
+            or (os.altsep and os.altsep in staged_name)):
+        raise ValueError(f"無效的暫存檔名: {staged_name}")
+    staging_dir = os.path.realpath(STAGING_DIR)
+    path = os.path.join(staging_dir, staged_name)
+    if os.path.dirname(os.path.realpath(path)) != staging_dir:
+        raise ValueError(f"無效的暫存檔名: {staged_name}")
+    return path
+
+
+def open_for_write(staged_name):
+    """開啟暫存檔的暫時檔案；寫完後必須呼叫 commit 才會出現在暫存區"""
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    return open(resolve(staged_name) + ".part", "wb")
+
+
+def commit(staged_name):
+    path = resolve(staged_name)
+    os.replace(path + ".part", path)
+    logger.debug("暫存檔已就緒: %s", path)
+    return path
+
+
+def remove(staged_name):
+    for path in (resolve(staged_name), resolve(staged_name) + ".part"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("刪除暫存檔 %s 失敗: %s", path, str(e))
@@ -0,0 +1,82 @@
+import time
+import json
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# 任務索引：sorted set，成員為任務 ID，分數為提交時間
+TASK_INDEX_KEY = "task_index"
+# 任務狀態變化透過此 pub/sub 頻道廣播
+TASK_EVENTS_CHANNEL = "task_events"
+TASK_INDEX_MAX_AGE_SECONDS = int(os.getenv("TASK_INDEX_MAX_AGE_SECONDS", str(24 * 3600)))
+TASK_INDEX_MAX_SIZE = int(os.getenv("TASK_INDEX_MAX_SIZE", "10000"))
+# 定期清理索引中結果已過期的任務 ID；各節點以鎖確保每個週期只有一個節點執行
+TASK_INDEX_COMPACT_INTERVAL = int(os.getenv("TASK_INDEX_COMPACT_INTERVAL", "300"))
+TASK_INDEX_COMPACT_LOCK = "task_index:compact_lock"
+TASK_INDEX_COMPACT_BATCH = 500
+# 沒有結果紀錄的任務可能仍在排隊，提交超過此秒數後才視為已過期
+TASK_INDEX_PENDING_GRACE_SECONDS = int(os.getenv("TASK_INDEX_PENDING_GRACE_SECONDS", "3600"))
+
+# Celery Redis 結果後端存放任務狀態的鍵
+TASK_META_PREFIX = "celery-task-meta-"
+
+READY_STATES = {"SUCCESS", "FAILURE", "FAILED", "REVOKED"}
+# 分片上傳以 PROGRESS 狀態回報的欄位
+PROGRESS_FIELDS = ("rows_done", "rows_total", "shards_done", "shards_total")
+
+
+def build_task_data(task_id, status, node="unknown", result=None, error=None, progress=None):
+    task_data = {"task_id": task_id, "status": status, "node": node}
+    if progress is not None:
+        task_data["progress"] = progress
+    if status in READY_STATES:
+        task_data["result"] = result if status == "SUCCESS" else None
+        task_data["error"] = error
+    return task_data
+
+
+def task_data_from_meta(task_id, raw_meta, decode=json.loads):
+    """將結果後端中的原始紀錄轉為任務列表項目；沒有紀錄表示仍在排隊
+
+    decode 為結果後端的解碼函式，結果以 msgpack 儲存時需傳入 Celery backend 的 decode。
+    """
+    if not raw_meta:
+        return build_task_data(task_id, "PENDING")
+    meta = decode(raw_meta)
+    status = meta.get("status", "PENDING")
+    info = meta.get("result")
+    node = info.get("node", "unknown") if isinstance(info, dict) else "unknown"
+    error = None
+    if status in ("FAILURE", "FAILED") and isinstance(info, dict):
+        error = info.get("error") or info.get("exc_message")
+        if isinstance(error, list):
+            error = " ".join(str(part) for part in error)
+    progress = None
+    if status == "PROGRESS" and isinstance(info, dict):
+        progress = {key: info[key] for key in PROGRESS_FIELDS if key in info}
+    return build_task_data(task_id, status, node, info, error, progress)
+
+
+def register_task(redis_client, task_id):
+    """將新提交的任務加入索引並順便修剪過舊或超量的項目"""
+    now = time.time()
+    pipe = redis_client.pipeline()
+    pipe.zadd(TASK_INDEX_KEY, {task_id: now})
+    pipe.zremrangebyscore(TASK_INDEX_KEY, "-inf", now - TASK_INDEX_MAX_AGE_SECONDS)
+    pipe.zremrangebyrank(TASK_INDEX_KEY, 0, -(TASK_INDEX_MAX_SIZE + 1))
+    pipe.publish(TASK_EVENTS_CHANNEL, json.dumps(build_task_data(task_id, "PENDING")))
+    pipe.execute()
+
+
+def publish_task_event(redis_client, task_id, status, node="unknown", result=None, error=None, progress=None):
+    try:
+        redis_client.publish(
+            TASK_EVENTS_CHANNEL,
+            json.dumps(build_task_data(task_id, status, node, result, error, progress),
+                       ensure_ascii=False, default=str)
+        )
+    except Exception as e:
+        logger.warning("發布任務 %s 狀態事件失敗: %s", task_id, str(e))
@@ -0,0 +1,83 @@
+from qdrant_client.http.models import Filter, FieldCondition, MatchValue, MatchAny, PayloadSchemaType
+import hashlib
+import json
+import time
+import re
+import os
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# 未指定租戶時使用的集合，與多租戶之前的部署相容
+DEFAULT_COLLECTION = "KnowledgeBase"
+DEFAULT_TENANT = "default"
+# 允許的租戶清單 (逗號分隔)；留空表示接受任何符合命名規則的租戶
+ALLOWED_TENANTS = {t for t in os.getenv("TENANTS", "").split(",") if t}
+# 可用於篩選的 payload 欄位，建立集合時會為它們建立 keyword 索引
+FILTER_FIELDS = tuple(f for f in os.getenv("PAYLOAD_INDEX_FIELDS", "source").split(",") if f)
+# 每個租戶每分鐘可提交的查詢與上傳數，0 表示不限制
+TENANT_QUERY_RATE_LIMIT = int(os.getenv("TENANT_QUERY_RATE_LIMIT", "0"))
+TENANT_UPLOAD_RATE_LIMIT = int(os.getenv("TENANT_UPLOAD_RATE_LIMIT", "0"))
+TENANT_RATE_PREFIX = "tenant_rate:"
+
+_TENANT_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,47}$")
+
+
+def collection_for(tenant=None):
+    """租戶對應的集合名稱；不合法或不在允許清單中的租戶會引發 ValueError"""
+    if not tenant or tenant == DEFAULT_TENANT:
+        return DEFAULT_COLLECTION
+    if not _TENANT_PATTERN.match(tenant):
+        raise ValueError(f"不合法的租戶名稱: {tenant}")
+    if ALLOWED_TENANTS and tenant not in ALLOWED_TENANTS:
+        raise ValueError(f"未知的租戶: {tenant}")
+    return f"tenant_{tenant}"
+
+
+def build_filter(filters):
+    """將 {"source": "a"} 或 {"source": ["a", "b"]} 轉為 Qdrant Filter；只允許已建立索引的欄位"""
+    if not filters:
+        return None
+    conditions = []
+    for field, value in sorted(filters.items()):
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"不支援篩選欄位: {field}，可用: {', '.join(FILTER_FIELDS)}")
+        if isinstance(value, (list, tuple)):
+            match = MatchAny(any=[str(v) for v in value])
+        else:
+            match = MatchValue(value=str(value))
+        conditions.append(FieldCondition(key=field, match=match))
+    return Filter(must=conditions)
+
+
+def filter_key(filters):
+    """篩選條件的穩定摘要，用於區分不同篩選的查詢結果快取與查詢批次"""
+    if not filters:
+        return ""
+    canonical = json.dumps(
+        {k: sorted(v) if isinstance(v, (list, tuple)) else v for k, v in filters.items()},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def ensure_payload_indexes(client, collection_name):
+    """為可篩選欄位建立 keyword 索引，篩選搜尋不必逐一檢查 payload"""
+    for field in FILTER_FIELDS:
+        client.create_payload_index(
+            collection_name=collection_name, field_name=field, field_schema=PayloadSchemaType.KEYWORD
+        )
+
+
+async def allow_request(redis, tenant, kind, limit):
+    """固定時間窗 (每分鐘) 計數；超過 limit 時回傳 False (asyncio Redis)"""
+    if limit <= 0:
+        return True
+    key = f"{TENANT_RATE_PREFIX}{kind}:{tenant or DEFAULT_TENANT}:{int(time.time() // 60)}"
+    pipe = redis.pipeline()
+    pipe.incr(key)
+    pipe.expire(key, 120)
+    count, _ = await pipe.execute()
+    return count <= limit
@@ -0,0 +1,74 @@
+"""嵌入後端的一致性檢查與吞吐量基準測試
+
+在 backend 目錄下執行:
+    python -m benchmarks.bench_embedders --rows 2000 --backends torch,torch-int8,onnx,onnx-int8
+
+以 float32 PyTorch 為參考，計算每個後端與參考向量的餘弦相似度；
+任一後端的最小相似度低於 --min-cosine 時以非零狀態結束，可作為切換後端前的一致性檢查。
+"""
+from app.services.embedders import create_embedder, BACKENDS
+from .synthetic import make_rows
+import numpy as np
+import argparse
+import sys
+import time
+
+
+def throughput(embedder, texts, batch_size, repeats):
+    embedder.encode(texts[:batch_size], batch_size=batch_size)
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        vectors = embedder.encode(texts, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(texts) / best, vectors
+
+
+def cosine(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def run(rows, backends, batch_size, threads, repeats, min_cosine):
+    texts = [row["content"] for row in make_rows(rows, min_words=2, max_words=120)]
+    reference_rate, reference = throughput(create_embedder("torch", threads=threads), texts, batch_size, repeats)
+    report = []
+    for backend in backends:
+        if backend == "torch":
+            rate, vectors = reference_rate, reference
+        else:
+            rate, vectors = throughput(create_embedder(backend, threads=threads), texts, batch_size, repeats)
+        similarity = cosine(vectors, reference)
+        entry = {
+            "backend": backend,
+            "rows_per_sec": round(rate, 1),
+            "speedup": round(rate / reference_rate, 2),
+            "cosine_min": round(float(similarity.min()), 5),
+            "cosine_mean": round(float(similarity.mean()), 5),
+        }
+        report.append(entry)
+        print(f"{backend:>10}  {entry['rows_per_sec']:10.1f} rows/sec  x{entry['speedup']:<5}  "
+              f"cosine min={entry['cosine_min']:.5f} mean={entry['cosine_mean']:.5f}")
+    failed = [entry["backend"] for entry in report if entry["cosine_min"] < min_cosine]
+    if failed:
+        print(f"一致性檢查失敗 (cosine < {min_cosine}): {', '.join(failed)}")
+        sys.exit(1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="嵌入後端一致性與吞吐量基準測試")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    args = parser.parse_args()
+    run(args.rows, args.backends.split(","), args.batch_size, args.threads, args.repeats, args.min_cosine)
+
+
+if __name__ == "__main__":
+    main()
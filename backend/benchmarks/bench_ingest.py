@@ -0,0 +1,45 @@
+"""批次嵌入管線的吞吐量基準測試
+
+在 backend 目錄下執行:
+    python -m benchmarks.bench_ingest --rows 5000 --batch-sizes 32,64,128,256,512
+
+使用 Qdrant 的 in-process :memory: 模式，不需要啟動任何服務。
+"""
+from qdrant_client import QdrantClient
+from app.services.qdrant_client import QdrantService
+from app.services import service_registry
+from .synthetic import make_rows
+import argparse
+import time
+
+
+def run(rows, batch_sizes):
+    vectorizer = service_registry.get_vectorizer()
+    data_list = make_rows(rows)
+    results = []
+    for batch_size in batch_sizes:
+        service = QdrantService(client=QdrantClient(":memory:"), vectorizer=vectorizer)
+        service.create_collection()
+        start = time.perf_counter()
+        service._embed_and_upload(data_list, batch_size)
+        service.client.close()
+        elapsed = time.perf_counter() - start
+        results.append({
+            "batch_size": batch_size,
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(rows / elapsed, 1),
+        })
+        print(f"batch_size={batch_size:>5}  {rows / elapsed:10.1f} rows/sec  ({elapsed:.2f}s)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次嵌入管線吞吐量基準測試")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--batch-sizes", default="32,64,128,256,512")
+    args = parser.parse_args()
+    run(args.rows, [int(size) for size in args.batch_sizes.split(",")])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""查詢微批次的負載測試：比較逐筆查詢與 QueryBatcher 的延遲與吞吐量
+
+在 backend 目錄下執行:
+    python -m benchmarks.bench_query_batching --docs 2000 --clients 32 --queries 20
+
+使用 Qdrant 的 in-process :memory: 模式，不需要啟動任何服務；查詢快取停用，
+每個查詢字串都不同，量測的是真正的編碼與搜尋成本。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from qdrant_client import QdrantClient
+from app.services.qdrant_client import QdrantService
+from app.services.query_batcher import QueryBatcher
+from app.services import service_registry
+from .synthetic import make_rows
+from .report import percentile
+import argparse
+import time
+
+
+def load(query_fn, clients, queries_per_client):
+    def worker(client_no):
+        latencies = []
+        for i in range(queries_per_client):
+            start = time.perf_counter()
+            query_fn(f"查詢 {client_no} 號客戶端 第 {i} 次 vector search latency")
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = [lat for result in pool.map(worker, range(clients)) for lat in result]
+    elapsed = time.perf_counter() - start
+    return {
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "throughput_qps": round(len(latencies) / elapsed, 1),
+    }
+
+
+def run(docs, clients, queries_per_client, window_ms, max_batch_size):
+    service = QdrantService(client=QdrantClient(":memory:"), vectorizer=service_registry.get_vectorizer())
+    service.create_collection()
+    service._embed_and_upload(make_rows(docs), 256)
+
+    report = {
+        "single": load(lambda q: service.query(q, limit=5), clients, queries_per_client),
+    }
+    batcher = QueryBatcher(lambda collection_name: service, window_ms=window_ms, max_batch_size=max_batch_size)
+    report["batched"] = load(lambda q: batcher.query(q, limit=5), clients, queries_per_client)
+    for mode, stats in report.items():
+        print(f"{mode:>8}  p50={stats['p50_ms']:8.2f}ms  p99={stats['p99_ms']:8.2f}ms  "
+              f"{stats['throughput_qps']:8.1f} q/s")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查詢微批次負載測試")
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=20, help="每個客戶端的查詢數")
+    parser.add_argument("--window-ms", type=float, default=3)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    args = parser.parse_args()
+    run(args.docs, args.clients, args.queries, args.window_ms, args.max_batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""各集合設定檔的召回率與查詢延遲，以完整掃描 (exact) 的結果作為基準
+
+需要實際的 Qdrant 服務 (in-process 模式不支援量化與 HNSW)，在 backend 目錄下執行:
+    docker run -p 6333:6333 qdrant/qdrant
+    python -m benchmarks.bench_recall --qdrant-url http://localhost:6333 --rows 20000 --ef 32,64,128,256
+
+每個設定檔會建立暫時的 bench_recall_<設定檔> 集合，結束後刪除。
+"""
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import CollectionStatus
+from app.services.collection_profiles import PROFILES, get_profile, collection_config, search_params
+from app.services import service_registry
+from .synthetic import make_rows, make_queries
+from .report import latency_summary, git_commit, save_results
+import argparse
+import time
+import os
+
+
+def build_collection(client, name, profile, vectors, timeout=600):
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(collection_name=name, **collection_config(profile, vectors.shape[1], hybrid=False))
+    client.upload_collection(collection_name=name, vectors=vectors, ids=list(range(len(vectors))), wait=True)
+    # 等待背景建立 HNSW 索引與量化向量，否則量到的是未索引的完整掃描
+    deadline = time.time() + timeout
+    while client.get_collection(name).status != CollectionStatus.GREEN:
+        if time.time() > deadline:
+            raise TimeoutError(f"集合 {name} 索引建立逾時")
+        time.sleep(1)
+
+
+def measure(client, name, query_vectors, limit, params, truth=None):
+    latencies, found = [], []
+    for vector in query_vectors:
+        start = time.perf_counter()
+        hits = client.search(collection_name=name, query_vector=vector, limit=limit, search_params=params)
+        latencies.append(time.perf_counter() - start)
+        found.append([hit.id for hit in hits])
+    stats = latency_summary(latencies)
+    if truth is not None:
+        stats["recall"] = round(
+            sum(len(set(ids) & set(expected)) for ids, expected in zip(found, truth)) / (limit * len(truth)), 4
+        )
+    return stats, found
+
+
+def run(args):
+    client = QdrantClient(url=args.qdrant_url, timeout=60)
+    vectorizer = service_registry.get_vectorizer()
+    texts = [row["content"] for row in make_rows(args.rows)]
+    vectors = vectorizer.encode(texts, batch_size=256, show_progress_bar=False)
+    query_vectors = vectorizer.encode(make_queries(args.queries), show_progress_bar=False).tolist()
+    ef_values = [int(ef) for ef in args.ef.split(",")]
+
+    results = {
+        "commit": git_commit(),
+        "config": {"rows": args.rows, "queries": args.queries, "limit": args.limit, "ef": ef_values},
+        "profiles": {},
+    }
+    truth = None
+    try:
+        for profile_name in args.profiles.split(","):
+            profile = get_profile(profile_name)
+            name = f"bench_recall_{profile_name}"
+            build_collection(client, name, profile, vectors)
+            if truth is None:
+                baseline, truth = measure(client, name, query_vectors, args.limit, search_params(profile, exact=True))
+                results["exact"] = baseline
+                print(f"{'exact':>10}  {'':>6}  recall=1.0000  p50={baseline['p50_ms']}ms p95={baseline['p95_ms']}ms")
+            rows = []
+            for ef in ef_values:
+                stats, _ = measure(client, name, query_vectors, args.limit, search_params(profile, hnsw_ef=ef), truth)
+                stats["hnsw_ef"] = ef
+                rows.append(stats)
+                print(f"{profile_name:>10}  ef={ef:<4}  recall={stats['recall']:.4f}  "
+                      f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms")
+            results["profiles"][profile_name] = rows
+            if not args.keep:
+                client.delete_collection(name)
+    finally:
+        client.close()
+    path = save_results(results, args.out)
+    print(f"結果已儲存至 {path}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="集合設定檔的召回率與延遲報告")
+    parser.add_argument("--qdrant-url", default="http://localhost:6333")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    parser.add_argument("--ef", default="32,64,128,256")
+    parser.add_argument("--keep", action="store_true", help="保留測試集合")
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(__file__), "results"))
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""比較兩次基準測試結果
+
+    python -m benchmarks.compare benchmarks/results/<舊>.json benchmarks/results/<新>.json
+"""
+import argparse
+import json
+
+# (欄位路徑, 數值越大越好)
+_METRICS = [
+    (("parse_streaming", "rows_per_sec"), True),
+    (("ingest", "rows_per_sec"), True),
+    (("reingest", "rows_per_sec"), True),
+    (("query_cold", "p50_ms"), False),
+    (("query_cold", "p95_ms"), False),
+    (("query_cold", "p99_ms"), False),
+    (("query_warm", "p50_ms"), False),
+    (("query_warm", "p99_ms"), False),
+    (("peak_rss_mb",), False),
+]
+
+
+def _lookup(results, path):
+    for key in path:
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
+
+
+def compare(old, new, threshold):
+    regressions = []
+    print(f"{'指標':<28}{old['commit']:>12}{new['commit']:>12}{'變化':>10}")
+    for path, higher_is_better in _METRICS:
+        before, after = _lookup(old, path), _lookup(new, path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else 0.0
+        worse = -change if higher_is_better else change
+        flag = "  <-- 退步" if worse > threshold else ""
+        if flag:
+            regressions.append(".".join(path))
+        print(f"{'.'.join(path):<28}{before:>12}{after:>12}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較兩次基準測試結果")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.1, help="視為退步的相對變化比例")
+    args = parser.parse_args()
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    regressions = compare(old, new, args.threshold)
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""可重現的端到端基準測試：上傳 (解析 + 嵌入 + 寫入) 與查詢路徑
+
+在 backend 目錄下執行:
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.suite --rows 20000 --queries 500
+
+- Qdrant 使用 in-process :memory: 模式 (或 --qdrant-path 指定的本機目錄)
+- Redis 使用 fakeredis，Celery 以 eager 模式在本行程執行任務，不需要任何網路服務
+- 結果以 JSON 存到 benchmarks/results/<commit>-<時間>.json，可用 benchmarks.compare 比較
+"""
+import argparse
+import shutil
+import tempfile
+import time
+import os
+
+from .report import latency_summary, peak_rss_mb, git_commit, save_results
+from .synthetic import write_csv, make_queries
+
+
+def _configure_environment(work_dir):
+    # 必須在匯入 app 模組之前設定，這些路徑在模組載入時讀取
+    os.environ["STAGING_DIR"] = os.path.join(work_dir, "staging")
+    os.environ["JOURNAL_DIR"] = os.path.join(work_dir, "journal")
+    os.environ["EMBED_CACHE_PATH"] = os.path.join(work_dir, "cache", "embeddings.sqlite")
+    # 單一行程執行，不使用 Prometheus 多行程模式
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+
+def _stage(staging, csv_path):
+    staged_name = staging.new_staged_name()
+    os.makedirs(staging.STAGING_DIR, exist_ok=True)
+    shutil.copyfile(csv_path, staging.resolve(staged_name))
+    return staged_name
+
+
+def _time_queries(query_task, queries):
+    latencies = []
+    for query_text in queries:
+        start = time.perf_counter()
+        query_task.delay(query_text).get()
+        latencies.append(time.perf_counter() - start)
+    return latency_summary(latencies)
+
+
+def run(args):
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit("需要 fakeredis：pip install -r benchmarks/requirements.txt")
+
+    work_dir = tempfile.mkdtemp(prefix="rag-bench-")
+    _configure_environment(work_dir)
+
+    from qdrant_client import QdrantClient
+    from app import celery_config
+    from app.services import service_registry, staging
+    from app.services.csv_processor import process_csv, iter_csv_records
+    from app.services.qdrant_client import QdrantService
+    from app.services.embedding_cache import EmbeddingCache
+    from app.services.query_cache import QueryCache
+
+    fake_redis = fakeredis.FakeRedis(decode_responses=True)
+    celery_config.redis_client = fake_redis
+    celery_config.app.conf.update(
+        task_always_eager=True,
+        task_eager_propagates=True,
+        result_backend="cache+memory://",
+    )
+
+    results = {
+        "commit": git_commit(),
+        "config": {
+            "rows": args.rows,
+            "min_words": args.min_words,
+            "max_words": args.max_words,
+            "queries": args.queries,
+            "qdrant": args.qdrant_path or ":memory:",
+        },
+    }
+
+    start = time.perf_counter()
+    vectorizer = service_registry.get_vectorizer()
+    results["model_load_seconds"] = round(time.perf_counter() - start, 3)
+    results["baseline_rss_mb"] = peak_rss_mb()
+
+    client = QdrantClient(path=args.qdrant_path) if args.qdrant_path else QdrantClient(":memory:")
+    service = QdrantService(
+        client=client,
+        vectorizer=vectorizer,
+        embedding_cache=EmbeddingCache(os.environ["EMBED_CACHE_PATH"], model_name="bench"),
+        query_cache=QueryCache(fake_redis),
+    )
+    service_registry.configure(service=service, redis_client=fake_redis)
+
+    csv_path = write_csv(os.path.join(work_dir, "bench.csv"), args.rows,
+                         min_words=args.min_words, max_words=args.max_words)
+    results["csv_bytes"] = os.path.getsize(csv_path)
+
+    try:
+        # 解析：整檔載入與串流兩種方式
+        with open(csv_path, "rb") as f:
+            content = f.read()
+        start = time.perf_counter()
+        parsed = len(process_csv(content))
+        elapsed = time.perf_counter() - start
+        del content
+        results["parse_in_memory"] = {"rows_per_sec": round(parsed / elapsed, 1)}
+
+        start = time.perf_counter()
+        streamed = sum(1 for _ in iter_csv_records(csv_path))
+        elapsed = time.perf_counter() - start
+        results["parse_streaming"] = {"rows_per_sec": round(streamed / elapsed, 1)}
+
+        # 上傳：透過 upload_task 走完整流程；第二次上傳相同檔案量測去重路徑
+        for phase in ("ingest", "reingest"):
+            staged_name = _stage(staging, csv_path)
+            start = time.perf_counter()
+            outcome = celery_config.upload_task.delay(staged_name).get()
+            elapsed = time.perf_counter() - start
+            results[phase] = {
+                "seconds": round(elapsed, 3),
+                "rows_per_sec": round(outcome["records"] / elapsed, 1),
+                "stats": {k: v for k, v in outcome.items() if k != "message"},
+                "peak_rss_mb": peak_rss_mb(),
+            }
+
+        # 查詢：第一輪全部未命中快取，第二輪重複相同查詢
+        queries = make_queries(args.queries)
+        results["query_cold"] = _time_queries(celery_config.query_task, queries)
+        results["query_warm"] = _time_queries(celery_config.query_task, queries)
+        results["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        client.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    path = save_results(results, args.out)
+    print(f"ingest: {results['ingest']['rows_per_sec']} rows/sec, "
+          f"reingest: {results['reingest']['rows_per_sec']} rows/sec, peak RSS {results['peak_rss_mb']} MB")
+    for phase in ("query_cold", "query_warm"):
+        stats = results[phase]
+        print(f"{phase}: p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+    print(f"結果已儲存至 {path}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上傳與查詢路徑的端到端基準測試")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--min-words", type=int, default=8)
+    parser.add_argument("--max-words", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--qdrant-path", default=None, help="使用本機持久化模式而非 :memory:")
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(__file__), "results"))
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""合成測試資料：可設定列數與每列長度，固定亂數種子以確保可重現"""
+import csv
+import random
+
+_WORDS = ["分散式", "檢索", "向量", "知識庫", "查詢", "節點", "任務", "模型",
+          "cluster", "vector", "search", "embedding", "latency", "batch",
+          "ERR-4021", "SKU-88310", "timeout", "replica"]
+
+
+def make_rows(count, min_words=8, max_words=40, seed=42, sources=4):
+    rng = random.Random(seed)
+    return [
+        {"content": " ".join(rng.choice(_WORDS) for _ in range(rng.randint(min_words, max_words))),
+         "source": f"benchmark-{rng.randrange(sources)}"}
+        for _ in range(count)
+    ]
+
+
+def write_csv(path, count, min_words=8, max_words=40, seed=42):
+    """以串流方式寫出 CSV，不在記憶體中保留所有列"""
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["content", "source"])
+        for _ in range(count):
+            writer.writerow([
+                " ".join(rng.choice(_WORDS) for _ in range(rng.randint(min_words, max_words))),
+                f"benchmark-{rng.randrange(4)}",
+            ])
+    return path
+
+
+def make_queries(count, seed=7):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(_WORDS) for _ in range(rng.randint(2, 6))) for _ in range(count)]
@@ -0,0 +1,46 @@
+from collections import namedtuple
+
+from app.services import bm25
+
+Hit = namedtuple("Hit", ["id"])
+
+DOCS = {
+    "target": "Error ERR-4021: upstream connection refused while syncing inventory",
+    "other-code": "Error ERR-4022: disk quota exceeded on the export volume",
+    "generic": "Connection errors usually mean the upstream service is unavailable",
+}
+
+
+def _sparse_ranking(query, docs):
+    """以 BM25 稀疏向量的內積排序 (不含 IDF)，模擬 Qdrant 的稀疏搜尋"""
+    query_vector = bm25.encode_query(query)
+    query_weights = dict(zip(query_vector.indices, query_vector.values))
+    scores = {}
+    for doc_id, text in docs.items():
+        doc_vector = bm25.encode_document(text)
+        score = sum(query_weights.get(i, 0.0) * v for i, v in zip(doc_vector.indices, doc_vector.values))
+        if score > 0:
+            scores[doc_id] = score
+    return [Hit(doc_id) for doc_id in sorted(scores, key=scores.get, reverse=True)]
+
+
+def test_tokenize_keeps_codes_and_parts():
+    tokens = bm25.tokenize("See ERR-4021 in v2.1.3")
+    assert "err-4021" in tokens
+    assert {"err", "4021", "v2.1.3"} <= set(tokens)
+
+
+def test_exact_code_ranks_first_after_fusion():
+    sparse = _sparse_ranking("ERR-4021", DOCS)
+    assert sparse[0].id == "target"
+    # 向量搜尋只找到語意相近的內容，精確的代碼命中不在其候選中
+    dense = [Hit("generic")] + [Hit(f"neighbour-{i}") for i in range(bm25.HYBRID_CANDIDATES - 1)]
+
+    fused = bm25.reciprocal_rank_fusion([dense, sparse], None, weights=bm25.HYBRID_WEIGHTS)
+    assert fused[0][0].id == "target"
+
+
+def test_default_weights_are_equal():
+    first, second = [Hit("a"), Hit("b")], [Hit("b"), Hit("a")]
+    scores = dict((hit.id, score) for hit, score in bm25.reciprocal_rank_fusion([first, second], None))
+    assert scores["a"] == scores["b"]
@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+from app.services import csv_processor
+from app.services.csv_processor import count_csv_rows, iter_csv_records
+
+
+def _write_csv(path, lines):
+    path.write_text("content,source\n" + "".join(line + "\n" for line in lines), encoding="utf-8")
+    return str(path)
+
+
+def _read_sharded(path, shard_rows, chunksize):
+    total = count_csv_rows(path, chunksize=chunksize)
+    records = []
+    for start in range(0, total, shard_rows):
+        records.extend(iter_csv_records(path, chunksize=chunksize, start=start,
+                                        stop=min(start + shard_rows, total)))
+    return records
+
+
+@pytest.mark.parametrize("shard_rows", [1, 7, 25, 1000])
+def test_sharded_read_matches_full_read(tmp_path, monkeypatch, shard_rows):
+    path = _write_csv(tmp_path / "rows.csv", [f"row {i},s{i % 3}" for i in range(100)])
+    # 模擬長時間運行的主機：計時器數值遠大於列數
+    monkeypatch.setattr(csv_processor.time, "perf_counter", lambda: time.monotonic() + 864000)
+
+    full = list(iter_csv_records(path, chunksize=10))
+    assert len(full) == 100
+    assert _read_sharded(path, shard_rows, chunksize=10) == full
+
+
+@pytest.mark.parametrize("shard_rows", [1, 2, 3, 5])
+def test_sharded_read_with_blank_lines_and_multiline_fields(tmp_path, shard_rows):
+    lines = ["a,x", "", "b,x", '"c\nmulti",x', "", "", "d,x", "e,x", "", "f,x"]
+    path = _write_csv(tmp_path / "blank.csv", lines)
+
+    full = list(iter_csv_records(path, chunksize=2))
+    assert [record["content"] for record in full] == ["a", "b", "c\nmulti", "d", "e", "f"]
+    assert _read_sharded(path, shard_rows, chunksize=2) == full
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("onnxruntime")
+
+from app.services.embedders import create_embedder
+
+TEXTS = [
+    "ERR-4021 timeout",
+    "如何重設密碼？",
+    "The quick brown fox jumps over the lazy dog.",
+    " ".join(["long content for truncation and bucketing"] * 60),
+]
+
+
+@pytest.fixture(scope="module")
+def reference():
+    try:
+        return create_embedder("torch")
+    except OSError as e:
+        pytest.skip(f"無法載入參考模型: {e}")
+
+
+@pytest.fixture(scope="module")
+def onnx_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp("models"))
+
+
+def _cosine(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+@pytest.mark.parametrize("backend, min_cosine", [
+    ("torch-int8", 0.98),
+    ("onnx", 0.999),
+    ("onnx-int8", 0.98),
+])
+def test_backend_matches_reference(reference, onnx_dir, backend, min_cosine):
+    embedder = create_embedder(backend, onnx_dir=onnx_dir)
+    expected = reference.encode(TEXTS, batch_size=2)
+    actual = embedder.encode(TEXTS, batch_size=2)
+    assert actual.shape == expected.shape
+    assert _cosine(actual, expected).min() >= min_cosine
+
+
+def test_max_seq_length_changes_cache_key_and_export(reference, onnx_dir):
+    truncated = create_embedder("onnx", onnx_dir=onnx_dir, max_seq_length=32)
+    full = create_embedder("onnx", onnx_dir=onnx_dir)
+    assert truncated.name != full.name
+    assert create_embedder("torch", max_seq_length=32).name != reference.name
+    assert truncated.tokenizer.model_max_length == 32
@@ -0,0 +1,87 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from qdrant_client import QdrantClient
+
+from app.services.embedding_cache import EmbeddingCache
+from app.services.qdrant_client import QdrantService, content_hash, point_id
+
+ROWS = [
+    {"content": "Reset your password from the account page", "source": "faq.csv"},
+    {"content": "ERR-4021 means the upstream connection was refused", "source": "errors.csv"},
+    {"content": "Invoices are emailed on the first of each month", "source": "faq.csv"},
+    # 同一批次內重複的列
+    {"content": "Reset your password from the account page", "source": "faq.csv"},
+]
+
+
+class StubEmbedder:
+    """以內容雜湊產生確定性的向量，並記錄實際編碼的內容"""
+
+    name = "stub"
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.encoded = []
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, **kwargs):
+        texts = [sentences] if isinstance(sentences, str) else list(sentences)
+        self.encoded.extend(texts)
+        vectors = np.stack([
+            np.random.default_rng(int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)).random(self.dim)
+            for text in texts
+        ]).astype(np.float32)
+        return vectors[0] if isinstance(sentences, str) else vectors
+
+
+@pytest.fixture
+def service(tmp_path):
+    client = QdrantClient(":memory:")
+    embedder = StubEmbedder()
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.sqlite"), model_name=embedder.name)
+    service = QdrantService(client=client, vectorizer=embedder, embedding_cache=cache,
+                            collection_name="test_dedup")
+    service.create_collection()
+    return service
+
+
+def _count(service):
+    return service.client.count(collection_name=service.collection_name, exact=True).count
+
+
+def test_point_ids_are_deterministic():
+    first = point_id(content_hash("same text"), "a.csv")
+    assert first == point_id(content_hash("same text"), "a.csv")
+    assert first != point_id(content_hash("same text"), "b.csv")
+
+
+def test_reingest_is_idempotent(service):
+    stats = service.store_data(ROWS, batch_size=8)
+    assert (stats["new"], stats["updated"], stats["unchanged"]) == (3, 0, 1)
+    assert stats["cache_hits"] == 0
+    assert _count(service) == 3
+    ids = {point.id for point in service.client.scroll(service.collection_name, limit=10)[0]}
+    assert ids == {point_id(content_hash(row["content"]), row["source"]) for row in ROWS}
+
+    encoded = len(service.vectorizer.encoded)
+    stats = service.store_data(ROWS, batch_size=8)
+    assert (stats["new"], stats["updated"], stats["unchanged"]) == (0, 0, 4)
+    assert _count(service) == 3
+    # 內容未變的列不會再次編碼
+    assert len(service.vectorizer.encoded) == encoded
+
+
+def test_cached_embeddings_skip_encoding(service):
+    service.store_data(ROWS[:2], batch_size=8)
+    # 新集合中寫入相同內容：point 不存在 (new)，但向量由嵌入快取提供
+    other = QdrantService(client=service.client, vectorizer=service.vectorizer,
+                          embedding_cache=service.embedding_cache, collection_name="test_dedup_other")
+    other.create_collection()
+    encoded = len(service.vectorizer.encoded)
+    stats = other.store_data(ROWS[:2], batch_size=8)
+    assert (stats["new"], stats["cache_hits"]) == (2, 2)
+    assert len(service.vectorizer.encoded) == encoded
@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("sentence_transformers")
+
+from app.services import query_cache
+from app.services.query_cache import QueryCache, summarize_cache_stats
+
+COLLECTION = "csv_data"
+VECTOR = np.linspace(0.0, 1.0, 8, dtype=np.float32)
+RESULTS = [{"content": "Reset your password from the account page", "score": 0.91}]
+
+
+@pytest.fixture
+def cache():
+    return QueryCache(fakeredis.FakeRedis(decode_responses=True), embed_cache_size=2)
+
+
+def test_embedding_lru(cache):
+    assert cache.get_embedding("Reset password") is None
+    cache.put_embedding("Reset password", VECTOR)
+    # 查詢文字經正規化後命中同一個項目
+    assert cache.get_embedding("  Reset   password ") is VECTOR
+
+    cache.put_embedding("second", VECTOR)
+    cache.put_embedding("third", VECTOR)
+    assert cache.get_embedding("Reset password") is None
+
+
+def test_result_hit_and_version_invalidation(cache):
+    cached, version = cache.get_results(COLLECTION, VECTOR, 5)
+    assert (cached, version) == (None, 0)
+    cache.put_results(COLLECTION, VECTOR, 5, version, RESULTS)
+
+    cached, _ = cache.get_results(COLLECTION, VECTOR, 5)
+    assert cached == RESULTS
+    # 不同的 limit 與篩選範圍分開存放
+    assert cache.get_results(COLLECTION, VECTOR, 10)[0] is None
+    assert cache.get_results(COLLECTION, VECTOR, 5, scope="source=faq.csv")[0] is None
+
+    assert cache.bump_version(COLLECTION) == 1
+    cached, version = cache.get_results(COLLECTION, VECTOR, 5)
+    assert (cached, version) == (None, 1)
+    assert cache.current_version(COLLECTION) == 1
+
+
+def test_result_ttl_expiry():
+    cache = QueryCache(fakeredis.FakeRedis(decode_responses=True), result_ttl=1)
+    cache.put_results(COLLECTION, VECTOR, 5, 0, RESULTS)
+    assert cache.get_results(COLLECTION, VECTOR, 5)[0] == RESULTS
+    time.sleep(1.1)
+    assert cache.get_results(COLLECTION, VECTOR, 5)[0] is None
+
+
+def test_stats_flush(cache, monkeypatch):
+    monkeypatch.setattr(query_cache, "CACHE_STATS_FLUSH_SECONDS", 0)
+    cache.get_results(COLLECTION, VECTOR, 5)
+    cache.put_results(COLLECTION, VECTOR, 5, 0, RESULTS)
+    cache.get_results(COLLECTION, VECTOR, 5)
+
+    stats = summarize_cache_stats(cache.redis.hgetall(query_cache.QUERY_CACHE_STATS_KEY))
+    assert stats["l2"] == {"hits": 1, "misses": 1, "hit_ratio": 0.5}
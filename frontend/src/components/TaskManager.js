@@ -23,6 +23,21 @@ const TaskManager = () => {
   useEffect(() => {
     // 任務 WebSocket
     const taskWs = new WebSocket('ws://localhost:8000/api/ws/tasks');
+    // 伺服器先登記連線再送快照，快照前可能已收到狀態變化；先暫存，收到快照後依任務 ID 合併
+    let snapshotReceived = false;
+    let pendingDeltas = [];
+    const applyDelta = (prev, changed) => {
+      if (changed.status === 'REVOKED') {
+        return prev.filter(task => task.task_id !== changed.task_id);
+      }
+      const index = prev.findIndex(task => task.task_id === changed.task_id);
+      if (index === -1) {
+        return [changed, ...prev];
+      }
+      const next = [...prev];
+      next[index] = { ...prev[index], ...changed };
+      return next;
+    };
     taskWs.onopen = () => {
       console.log('任務 WebSocket 連線成功');
       setLoading(false);
@@ -31,14 +46,19 @@ const TaskManager = () => {
       try {
         const data = JSON.parse(event.data);
         console.log('收到任務 WebSocket 數據:', data);
-        const tasks = data.tasks || [];
-        tasks.forEach(task => {
-          console.log(`任務 ${task.task_id} 狀態: ${task.status}`);
-          if (task.status === 'PENDING') {
-            console.log(`應顯示取消按鈕 for 任務 ${task.task_id}`);
+        if (data.type === 'delta') {
+          // 只收到單一任務的狀態變化，合併到現有列表
+          if (!snapshotReceived) {
+            pendingDeltas.push(data.task);
+          } else {
+            setTasks(prev => applyDelta(prev, data.task));
           }
-        });
-        setTasks(tasks);
+        } else {
+          const deltas = pendingDeltas;
+          snapshotReceived = true;
+          pendingDeltas = [];
+          setTasks(deltas.reduce(applyDelta, data.tasks || []));
+        }
         setError(null);
       } catch (err) {
         setError('解析任務數據失敗');
@@ -110,7 +130,13 @@ const TaskManager = () => {
               <td>{task.task_id}</td>
               <td>{task.status}</td>
               <td>{task.node}</td>
-              <td>{task.result ? JSON.stringify(task.result, null, 2) : task.error || '-'}</td>
+              <td>
+                {task.result
+                  ? JSON.stringify(task.result, null, 2)
+                  : task.status === 'PROGRESS' && task.progress
+                    ? `${task.progress.rows_done}/${task.progress.rows_total} 列，分片 ${task.progress.shards_done}/${task.progress.shards_total}`
+                    : task.error || '-'}
+              </td>
               <td>
                 {task.status === 'PENDING' ? (
                   <button onClick={() => cancelTask(task.task_id)}>取消</button>
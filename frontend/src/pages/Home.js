@@ -16,8 +16,8 @@ const Home = () => {
     setError(null);
     setResult(null);
     try {
-      // 提交查詢任務
-      const response = await fetch('http://localhost:8000/api/query', {
+      // 優先直接查詢；後端滿載時會改為提交任務並回傳 task_id
+      const response = await fetch('http://localhost:8000/api/query/direct', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ query }),
@@ -26,6 +26,11 @@ const Home = () => {
         throw new Error('查詢任務提交失敗');
       }
       const data = await response.json();
+      if (data.mode === 'direct') {
+        setResult(JSON.stringify({ results: data.results }, null, 2));
+        setLoading(false);
+        return;
+      }
       const taskId = data.task_id;
 
       // 輪詢任務狀態